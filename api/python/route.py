@@ -1,18 +1,27 @@
+import time
+
+# Cold-start cost is everything from here to the end of module setup.
+STARTED = time.perf_counter()
+
 import json
 import os
-import sys
 import tempfile
-import ssl
-import urllib.request
-import urllib.error
-import subprocess
-import shutil
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
-from flask import Flask, request
+from flask import Flask, Response, request
 
-# Import analysis functions from video.py
-from video import mood, hand
+# Only lightweight modules are imported here. The analyzers pull in OpenCV,
+# MediaPipe, librosa and Praat, and are loaded through load() by the first
+# request that needs them (or by warm_up()); their parameters and result
+# types come from config.
+from engine import AnalysisEngine, WORKERS
+from config import DEFAULT_SAMPLE_RATES, DETAIL_LEVELS
+from media import open_url, prepare_for_decode, DECODERS, DEFAULT_DECODER
+from cache import open_cache, hash_file
+from jobs import JobQueue, QueueFull
+from metrics import Trace, REGISTRY, load
 
 # Suppress library logging to prevent invalid JSON output
 os.environ['TF_CPP_MIN_LOG_LEVEL'] = '3'
@@ -22,121 +31,216 @@ logging.getLogger().setLevel(logging.ERROR)
 
 app = Flask(__name__)
 
-def download_to_file(url: str, output_path: str) -> None:
-    """Download a file from URL to local path."""
+# Analysis runs in a pool of long-lived worker processes; ANALYSIS_WORKERS=0
+# keeps it in this process instead.
+engine = AnalysisEngine() if WORKERS > 0 else None
+
+# Results keyed by video hash and analyzer config; ANALYSIS_CACHE=off disables it.
+result_cache = open_cache()
+
+# When set, analyzers write per-sample feature records here (see features.py)
+# so scores can be recomputed later without decoding the video again.
+FEATURE_DIR = os.environ.get('ANALYSIS_FEATURE_DIR')
+
+# Submitted jobs wait here for one of a fixed number of runners.
+job_queue = JobQueue()
+
+def warm_up(modes: tuple = ("mood", "hand", "audio")) -> None:
+    """Load the analyzers for `modes` and build their models ahead of any request.
+    
+    Long-running servers call this at startup (ANALYSIS_WARM_MODELS=1);
+    serverless deployments can skip it or hit /api/analysis/warmup instead.
+    """
+    modules = ["audio"] if "audio" in modes else []
+    if "mood" in modes or "hand" in modes:
+        modules.insert(0, "video")
+    if engine is not None:
+        engine.warm_up(modules)
+        return
+    for module in modules:
+        load(module)
+    kinds = [kind for mode, kind in (("hand", "hands"), ("mood", "face_mesh")) if mode in modes]
+    load("models").warm_up(kinds)
+
+HAND_FALLBACK = {"hand": 0.0}
+MOOD_FALLBACK = {
+    "mood": "OVERALL: No Detection",
+    "mood_score": 0.0,
+    "expression": "No Detection",
+    "smile_score": 0.0
+}
+AUDIO_FALLBACK = {"audio": "No Detection"}
+
+REGISTRY.record_import("startup", time.perf_counter() - STARTED)
+
+# Warming trades a slower start for a fast first request, so it is opt-in.
+if os.environ.get('ANALYSIS_WARM_MODELS', '0') == '1':
+    warm_up()
+
+def download_to_file(url: str, output_path: str, trace: Trace = None) -> str:
+    """Download a file from URL to local path and return its SHA-256 digest."""
+    digest = hashlib.sha256()
+    trace = trace or Trace()
     try:
-        context = ssl._create_unverified_context()
-        with urllib.request.urlopen(url, context=context) as response:
-            if response.status != 200:
-                raise Exception(f"Failed to download file: {response.status}")
-            
+        with trace.stage("download", bytes=0) as counters, open_url(url) as response:
             with open(output_path, 'wb') as f:
-                shutil.copyfileobj(response, f)
+                for chunk in iter(lambda: response.read(1024 * 1024), b''):
+                    digest.update(chunk)
+                    f.write(chunk)
+                    counters["bytes"] += len(chunk)
+        return digest.hexdigest()
     except Exception as e:
         # Clean up partial file on error
         if os.path.exists(output_path):
             os.unlink(output_path)
         raise e
 
-def convert_video_to_mp4(input_path: str, output_path: str) -> None:
-    """Convert video to MP4 using ffmpeg if available."""
+def run_analysis(video_path: str, modes: tuple, sample_rates: dict = None, video_hash: str = None,
+                 decoder: str = None, trace: Trace = None) -> dict:
+    """Run the given analyzers on the worker pool, or in-process without one.
+    
+    With a `video_hash`, cached results are returned for analyzers whose
+    config has not changed and only the rest are run. `decoder` picks the
+    frame-source backend ("opencv" or "ffmpeg").
+    """
+    trace = trace or Trace()
+    results = {}
+    if result_cache is not None and video_hash:
+        with trace.stage("cache.lookup"):
+            results = result_cache.get(video_hash, modes, sample_rates, decoder)
+    missing = tuple(name for name in modes if name not in results)
+    if not missing:
+        return results
+    
+    features_path = None
+    if FEATURE_DIR and video_hash:
+        os.makedirs(FEATURE_DIR, exist_ok=True)
+        features_path = os.path.join(FEATURE_DIR, video_hash)
+    
+    if engine is None:
+        computed = load("video").analyze(video_path, modes=missing, sample_rates=sample_rates,
+                                         features_path=features_path, decoder=decoder, trace=trace)
+    else:
+        computed = engine.analyze(video_path, missing, sample_rates, features_path=features_path,
+                                  decoder=decoder, trace=trace)
+    if result_cache is not None and video_hash:
+        result_cache.put(video_hash, computed, sample_rates, decoder)
+    results.update(computed)
+    return results
+
+def analyze_hand_motion(video_file: str, sample_rates: dict = None, video_hash: str = None, decoder: str = None,
+                        trace: Trace = None) -> dict:
+    """Analyze hand motion in video file using the video.py analyzers."""
     try:
-        # Try to find ffmpeg in common locations
-        ffmpeg_paths = ['ffmpeg', '/usr/bin/ffmpeg', '/usr/local/bin/ffmpeg']
-        ffmpeg_cmd = None
-        
-        for path in ffmpeg_paths:
-            if shutil.which(path):
-                ffmpeg_cmd = path
-                break
-        
-        if not ffmpeg_cmd:
-            raise Exception("ffmpeg not found")
-        
-        # Run ffmpeg conversion
-        cmd = [
-            ffmpeg_cmd,
-            '-i', input_path,
-            '-c:v', 'libx264',
-            '-c:a', 'aac',
-            '-y',  # Overwrite output file
-            output_path
-        ]
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, timeout=300)
-        
-        if result.returncode != 0:
-            raise Exception(f"FFmpeg conversion failed: {result.stderr}")
-            
-    except subprocess.TimeoutExpired:
-        raise Exception("FFmpeg conversion timed out")
+        return to_response(run_analysis(video_file, ("hand",), sample_rates, video_hash, decoder, trace))["hand"]
     except Exception as e:
-        raise Exception(f"Video conversion failed: {str(e)}")
+        return dict(HAND_FALLBACK)
 
-def analyze_hand_motion(video_file: str) -> dict:
-    """Analyze hand motion in video file using the video.py function."""
-    import io
-    import contextlib
-    
-    # Capture the output from the hand function
-    captured_output = io.StringIO()
-    with contextlib.redirect_stdout(captured_output):
-        try:
-            hand(video_file)
-        except Exception as e:
-            return {"hand": 0.0}
+def analyze_mood(video_path: str, sample_rates: dict = None, video_hash: str = None, decoder: str = None,
+                 trace: Trace = None) -> dict:
+    """Analyze mood and facial expressions in video file using the video.py analyzers."""
+    try:
+        return to_response(run_analysis(video_path, ("mood",), sample_rates, video_hash, decoder, trace))["mood"]
+    except Exception as e:
+        return dict(MOOD_FALLBACK)
+
+def analyze_audio(video_path: str, detail: str = 'summary', video_hash: str = None, trace: Trace = None) -> dict:
+    """Analyze voice quality, pitch and speaking rate using the audio.py analyzer.
     
-    # Parse the JSON output
+    `detail` selects how much per-frame data comes back: 'summary',
+    downsampled 'series', or 'full' base64 float16 arrays. With a
+    `video_hash` the result is cached like the video analyzers' results.
+    """
+    trace = trace or Trace()
+    if result_cache is not None and video_hash:
+        with trace.stage("cache.lookup"):
+            cached = result_cache.get_audio(video_hash, detail)
+        if cached is not None:
+            return cached
     try:
-        result = json.loads(captured_output.getvalue())
-        return result
-    except json.JSONDecodeError:
-        return {"hand": 0.0}
-
-def analyze_mood(video_path: str) -> dict:
-    """Analyze mood and facial expressions in video file using the video.py function."""
-    import io
-    import contextlib
+        if engine is None:
+            result = load("audio").analyze_audio_from_mp4(video_path, detail=detail, trace=trace)
+        else:
+            result = engine.analyze_audio(video_path, detail, trace=trace)
+    except Exception as e:
+        return dict(AUDIO_FALLBACK)
+    if result_cache is not None and video_hash:
+        result_cache.put_audio(video_hash, result, detail)
+    return result
+
+def modes_for(mode: str) -> tuple:
+    """Map the request's mode onto the analyzers to run."""
+    if mode in ('mood', 'hand', 'audio'):
+        return (mode,)
+    if mode == 'all':
+        return ("mood", "hand", "audio")
+    return ("mood", "hand")
+
+def analyze_streaming(video_url: str, mode: str, sample_rates: dict = None, audio_detail: str = 'summary',
+                      trace: Trace = None) -> dict:
+    """Analyze a remote video while it downloads, overlapping network and compute.
     
-    # Capture the output from the mood function
-    captured_output = io.StringIO()
-    with contextlib.redirect_stdout(captured_output):
-        try:
-            mood(video_path)
-        except Exception as e:
-            return {
-                "mood": "OVERALL: No Detection",
-                "mood_score": 0.0,
-                "expression": "No Detection",
-                "smile_score": 0.0
-            }
+    Streaming always samples by media time; without `sample_rates` the
+    analyzers' defaults are used. Audio needs the whole track, so it runs on
+    the finished download. The video hash is only known once the download
+    is complete, so the cache is written afterwards but not consulted;
+    results are stored under the "ffmpeg" decoder, which analyze_url uses
+    on every path.
+    """
+    sample_rates = sample_rates or DEFAULT_SAMPLE_RATES
+    modes = modes_for(mode)
+    video_modes = tuple(name for name in modes if name != "audio")
+    with tempfile.NamedTemporaryFile(delete=False) as temp_file:
+        temp_path = temp_file.name
     
-    # Parse the JSON output
     try:
-        result = json.loads(captured_output.getvalue())
-        return result
-    except json.JSONDecodeError:
-        return {
-            "mood": "OVERALL: No Detection",
-            "mood_score": 0.0,
-            "expression": "No Detection",
-            "smile_score": 0.0
-        }
+        if engine is None:
+            results = load("streaming").analyze_url(video_url, temp_path, modes=video_modes,
+                                                       sample_rates=sample_rates, trace=trace)
+        else:
+            results = engine.analyze_url(video_url, temp_path, video_modes, sample_rates, trace=trace)
+        video_hash = hash_file(temp_path) if result_cache is not None else None
+        if video_hash:
+            result_cache.put(video_hash, results, sample_rates, "ffmpeg")
+        response = to_response(results)
+        if "audio" in modes:
+            response["audio"] = analyze_audio(temp_path, audio_detail, video_hash, trace)
+    except Exception as e:
+        response = {}
+    finally:
+        try:
+            os.unlink(temp_path)
+        except:
+            pass
+    
+    fallbacks = {"mood": MOOD_FALLBACK, "hand": HAND_FALLBACK, "audio": AUDIO_FALLBACK}
+    return {name: response.get(name) or dict(fallbacks[name]) for name in modes}
 
-def analyze_video(video_path: str) -> dict:
-    """Run both mood and hand analysis on a video file."""
-    import concurrent.futures
+def to_response(results: dict) -> dict:
+    """Convert typed analyzer results into the JSON response payload."""
+    response = {}
+    if "mood" in results:
+        response["mood"] = results["mood"].to_dict()
+    if "hand" in results:
+        hand_result = results["hand"]
+        response["hand"] = hand_result.to_dict() if hand_result.detected else dict(HAND_FALLBACK)
+    return response
+
+def analyze_video(video_path: str, sample_rates: dict = None, video_hash: str = None, decoder: str = None,
+                  trace: Trace = None) -> dict:
+    """Run both mood and hand analysis over a single decode of the video file.
     
-    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as executor:
-        mood_future = executor.submit(analyze_mood, video_path)
-        hand_future = executor.submit(analyze_hand_motion, video_path)
-        
-        mood_result = mood_future.result()
-        hand_result = hand_future.result()
+    With `sample_rates` frames are picked by media timestamp and unsampled
+    frames are never decoded.
+    """
+    try:
+        results = to_response(run_analysis(video_path, ("mood", "hand"), sample_rates, video_hash, decoder, trace))
+    except Exception as e:
+        results = {}
     
     return {
-        "mood": mood_result,
-        "hand": hand_result
+        "mood": results.get("mood") or dict(MOOD_FALLBACK),
+        "hand": results.get("hand") or dict(HAND_FALLBACK)
     }
 
 
@@ -144,67 +248,65 @@ def analyze_video(video_path: str) -> dict:
 def index():
     return 'Hello, World!'
 
-@app.route('/api/analysis', methods=['POST'])
-def analyze():
-    """Main handler function for the API."""
-    print(request.get_json())
-    print(request.get_json().get('videoUrl'))
-    print(request.get_json().get('mode'))
+def run_request(data: dict, progress=None, trace: Trace = None):
+    """Download, prepare and analyze the video described by a request body.
     
+    Returns the response payload, or an (error, status) pair. `progress` is
+    called with the name of each stage as it starts, and stage timings are
+    recorded into `trace`.
+    """
+    progress = progress or (lambda stage: None)
+    trace = trace or Trace()
     
     try:
-        video_url = request.get_json().get('videoUrl')
-        mode = request.get_json().get('mode', 'both')  # Default to both if not specified
+        video_url = data.get('videoUrl')
+        mode = data.get('mode', 'both')  # Default to both if not specified
+        sampling = data.get('sampling', 'frames')  # 'frames' or 'time'
+        streaming = data.get('streaming', False)  # Analyze while downloading
+        audio_detail = data.get('audioDetail', 'summary')  # 'summary', 'series' or 'full'
+        decoder = data.get('decoder') or DEFAULT_DECODER  # 'opencv' or 'ffmpeg'
         
         if not video_url:
             return {
                 "error": "Missing videoUrl in request body"
             }, 400
+        
+        if decoder not in DECODERS:
+            return {
+                "error": "Unknown decoder",
+                "details": f"decoder must be one of {', '.join(DECODERS)}"
+            }, 400
+        
+        if audio_detail not in DETAIL_LEVELS:
+            return {
+                "error": "Unknown audioDetail",
+                "details": f"audioDetail must be one of {', '.join(DETAIL_LEVELS)}"
+            }, 400
 
-        # Check if the file URL ends with .mp4
-        if 'mp4' not in video_url.lower():
-            # Try to convert non-MP4 videos
-            try:
-                with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_output:
-                    temp_input_path = tempfile.mktemp()
-                    temp_output_path = temp_output.name
-                
-                # Download the video
-                download_to_file(video_url, temp_input_path)
-                
-                # Convert to MP4
-                convert_video_to_mp4(temp_input_path, temp_output_path)
-                
-                # Analyze the converted video based on mode
-                if mode == 'mood':
-                    result = {"mood": analyze_mood(temp_output_path)}
-                elif mode == 'hand':
-                    result = {"hand": analyze_hand_motion(temp_output_path)}
-                else:
-                    result = analyze_video(temp_output_path)
-                
-                # Clean up temporary files
-                try:
-                    os.unlink(temp_input_path)
-                    os.unlink(temp_output_path)
-                except:
-                    pass
-                
-                return result
-                
-            except Exception as e:
-                return {
-                    "error": "Conversion to MP4 failed",
-                    "details": str(e)
-                }, 500
+        modes = modes_for(mode)
+        video_modes = tuple(name for name in modes if name != "audio")
+        # sampling='time' picks frames by media timestamp on every path.
+        sample_rates = DEFAULT_SAMPLE_RATES if sampling == 'time' and video_modes else None
 
-        # For proper MP4s, analyze directly
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp4') as temp_file:
+        # Decode frames as they arrive; ffmpeg handles WebM and faststart MP4
+        # directly, so no separate conversion step is needed here.
+        if streaming and video_modes:
+            progress("analyzing")
+            return analyze_streaming(video_url, mode, sample_rates, audio_detail, trace)
+
+        # The container is sniffed from the downloaded bytes rather than the
+        # URL, so no suffix is assumed here.
+        with tempfile.NamedTemporaryFile(delete=False) as temp_file:
             temp_path = temp_file.name
+        decode_path = temp_path
+        # Audio runs beside conversion and video analysis on the same file.
+        audio_pool = ThreadPoolExecutor(max_workers=1)
+        audio_future = None
 
         try:
             # Download the video
-            download_to_file(video_url, temp_path)
+            progress("downloading")
+            video_hash = download_to_file(video_url, temp_path, trace)
             
             # Check if file was downloaded successfully
             if not os.path.exists(temp_path):
@@ -218,22 +320,55 @@ def analyze():
                     "error": "Video is empty"
                 }, 500
             
+            if "audio" in modes:
+                # ffmpeg reads the audio from the original download directly.
+                audio_future = audio_pool.submit(analyze_audio, temp_path, audio_detail, video_hash, trace)
+            
+            # Look the video up before converting it: when every analyzer's
+            # result is cached the OpenCV-readable copy is never needed.
+            cached = {}
+            if video_modes and result_cache is not None:
+                with trace.stage("cache.lookup"):
+                    cached = result_cache.get(video_hash, video_modes, sample_rates, decoder)
+            
+            # Decode browser WebM and MP4 directly; remux or transcode only
+            # what OpenCV cannot open. ffmpeg reads anything it can probe.
+            if decoder == 'opencv' and any(name not in cached for name in video_modes):
+                progress("converting")
+                try:
+                    with trace.stage("convert"):
+                        decode_path = prepare_for_decode(temp_path)
+                except Exception as e:
+                    return {
+                        "error": "Video conversion failed",
+                        "details": str(e)
+                    }, 500
+            
             # Analyze the video based on mode
-            if mode == 'mood':
-                result = {"mood": analyze_mood(temp_path)}
-            elif mode == 'hand':
-                result = {"hand": analyze_hand_motion(temp_path)}
+            progress("analyzing")
+            if video_modes == ("mood",):
+                result = {"mood": analyze_mood(decode_path, sample_rates, video_hash, decoder, trace)}
+            elif video_modes == ("hand",):
+                result = {"hand": analyze_hand_motion(decode_path, sample_rates, video_hash, decoder, trace)}
+            elif video_modes:
+                result = analyze_video(decode_path, sample_rates, video_hash, decoder, trace)
             else:
-                result = analyze_video(temp_path)
+                result = {}
+            
+            if audio_future is not None:
+                result["audio"] = audio_future.result()
             
             return result
             
         finally:
-            # Clean up the downloaded file
-            try:
-                os.unlink(temp_path)
-            except:
-                pass
+            # Let audio finish with the file before it is removed
+            audio_pool.shutdown(wait=True)
+            # Clean up the downloaded file and any converted copy
+            for path in {temp_path, decode_path}:
+                try:
+                    os.unlink(path)
+                except:
+                    pass
                 
     except Exception as e:
         return {
@@ -241,6 +376,96 @@ def analyze():
             "details": str(e)
         }, 500
 
+def run_traced(data: dict, progress=None):
+    """run_request with a fresh Trace; returns (payload, status, trace)."""
+    trace = Trace()
+    with trace.stage("request"):
+        response = run_request(data, progress, trace)
+    payload, status = response if isinstance(response, tuple) else (response, 200)
+    return payload, status, trace
+
+def record_metrics(data: dict, status: int, trace: Trace) -> None:
+    """Feed a finished request into the metrics registry and structured log."""
+    REGISTRY.observe(trace, status="ok" if status < 400 else "error",
+                     mode=data.get('mode', 'both'), http_status=status)
+
+def run_job(data: dict, progress=None) -> dict:
+    """Job body for the queue: the payload on success, an exception otherwise."""
+    payload, status, trace = run_traced(data, progress)
+    record_metrics(data, status, trace)
+    if status >= 400:
+        raise Exception(payload.get("details") or payload["error"])
+    if data.get('metrics'):
+        payload = dict(payload, metrics=trace.to_dict())
+    return payload
+
+@app.route('/api/analysis', methods=['POST'])
+def analyze():
+    """Main handler function for the API.
+    
+    With "metrics": true in the body, per-stage timings are added to the
+    response under "metrics".
+    """
+    data = request.get_json()
+    print(data)
+    print(data.get('videoUrl'))
+    print(data.get('mode'))
+    
+    payload, status, trace = run_traced(data)
+    with trace.stage("encode") as counters:
+        body = json.dumps(payload)
+        counters["bytes"] = len(body)
+    record_metrics(data, status, trace)
+    if data.get('metrics'):
+        body = json.dumps(dict(payload, metrics=trace.to_dict()))
+    return Response(body, status=status, mimetype='application/json')
+
+@app.route('/api/analysis/metrics', methods=['GET'])
+def metrics():
+    """Prometheus-style totals over every request this process has served."""
+    return Response(REGISTRY.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/api/analysis/warmup', methods=['POST'])
+def warmup():
+    """Load the analyzers and their models now rather than on the first request."""
+    data = request.get_json(silent=True) or {}
+    modes = modes_for(data.get('mode', 'all'))
+    started = time.perf_counter()
+    warm_up(modes)
+    return {
+        "warmed": list(modes),
+        "seconds": time.perf_counter() - started
+    }
+
+@app.route('/api/analysis/jobs', methods=['POST'])
+def submit_job():
+    """Queue an analysis and return its job id without waiting for it."""
+    data = request.get_json(silent=True) or {}
+    if not data.get('videoUrl'):
+        return {
+            "error": "Missing videoUrl in request body"
+        }, 400
+    
+    try:
+        job = job_queue.submit(run_job, data)
+    except QueueFull as e:
+        return {
+            "error": "Too many pending analyses",
+            "details": str(e)
+        }, 429, {"Retry-After": "30"}
+    
+    return job.to_dict(), 202
+
+@app.route('/api/analysis/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Report a job's status and stage, and its result once it is done."""
+    job = job_queue.get(job_id)
+    if job is None:
+        return {
+            "error": "Unknown job"
+        }, 404
+    return job.to_dict()
+
 # For Vercel serverless function
 def handler_vercel(request):
     """Vercel Python serverless function handler."""
@@ -281,7 +506,8 @@ def handler_vercel(request):
                 'body': json.dumps({'error': 'Invalid JSON in request body'})
             }
         
-        result, status_code = analyze(request_data)
+        result, status_code, trace = run_traced(request_data)
+        record_metrics(request_data, status_code, trace)
         
         return {
             'statusCode': status_code,
@@ -317,6 +543,6 @@ if __name__ == "__main__":
     video_url = sys.argv[1]
     request_data = {"videoUrl": video_url}
     
-    result, status_code = analyze(request_data)
+    result, status_code, _ = run_traced(request_data)
     print(f"Status: {status_code}")
     print(json.dumps(result, indent=2))
@@ -1,12 +1,25 @@
-from moviepy.editor import VideoFileClip
+import base64
+import logging
+import multiprocessing
+import threading
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 
 import librosa
-import librosa.display
-import pandas as pd
+import numpy as np
 
 import parselmouth
 from parselmouth.praat import call
 
+from config import (N_FFT, HOP_LENGTH, N_MFCC, VAD_THRESHOLD_DB, VAD_MIN_PAUSE, VAD_MIN_SPEECH, VAD_PAD,
+                    CHUNKED_MIN_DURATION, CHUNK_SECONDS, CHUNK_CONTEXT, DETAIL_LEVELS, SERIES_POINTS)
+from engine import AUDIO_WORKERS
+from media import decode_audio, AUDIO_SAMPLE_RATE
+from metrics import Trace
+
+logger = logging.getLogger("analysis.audio")
+
 # # To view audio waveform
 # import matplotlib.pyplot as plt
 
@@ -61,162 +74,477 @@ from parselmouth.praat import call
 # print(f"Jitter (local): {jitter_local:.4f}")
 # print(f"Shimmer (local): {shimmer_local:.4f}")
 
-def analyze_audio_from_mp4(video_path):
+# Leading frames librosa's centered onset envelope sets to zero.
+ONSET_PAD = 1 + N_FFT // (2 * HOP_LENGTH)
+
+# Started by the first long recording and kept for the ones after it, so
+# each does not pay for spawning and importing librosa in fresh processes.
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def get_executor(workers):
+    """The shared process pool for chunked analysis, with `workers` processes."""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is not None and _executor_workers != workers:
+            _executor.shutdown(wait=False)
+            _executor = None
+        if _executor is None:
+            _executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+            _executor_workers = workers
+        return _executor
+
+
+def _discard_executor(executor):
+    # A worker died; the next long recording starts a fresh pool.
+    global _executor
+    with _executor_lock:
+        if _executor is executor:
+            _executor = None
+    executor.shutdown(wait=False, cancel_futures=True)
+
+
+def extract_spectral_features(y, sr):
+    """
+    Compute all spectral features from a single STFT of the signal.
+    
+    The magnitude spectrogram and the mel spectrogram derived from it are
+    built once; MFCCs, RMS energy, spectral centroid/rolloff and the onset
+    envelope used for beat tracking all read from those shared arrays
+    instead of each running its own STFT.
+    
+    Args:
+        y (np.ndarray): Mono audio signal
+        sr (int): Sample rate of `y`
+        
+    Returns:
+        dict: Feature arrays keyed by name, plus tempo and beat frames
+    """
+    log_mel, features = _frame_features(y, sr)
+    onset_envelope = librosa.onset.onset_strength(S=log_mel, sr=sr, hop_length=HOP_LENGTH)
+    return _add_rhythm(features, onset_envelope, sr)
+
+
+def _frame_features(y, sr):
+    # Per-frame features, plus the log-mel spectrogram for the onset envelope.
+    # RMS stays in the time domain: from the STFT it would read lower (the
+    # window tapers each frame), moving every loudness value and threshold.
+    magnitude = np.abs(librosa.stft(y, n_fft=N_FFT, hop_length=HOP_LENGTH))
+    mel = librosa.feature.melspectrogram(S=magnitude ** 2, sr=sr)
+    log_mel = librosa.power_to_db(mel)
+    return log_mel, {
+        "mfccs": librosa.feature.mfcc(S=log_mel, n_mfcc=N_MFCC),
+        "rms": librosa.feature.rms(y=y, frame_length=N_FFT, hop_length=HOP_LENGTH),
+        "spectral_centroid": librosa.feature.spectral_centroid(S=magnitude, sr=sr),
+        "spectral_rolloff": librosa.feature.spectral_rolloff(S=magnitude, sr=sr),
+        "zero_crossing_rate": librosa.feature.zero_crossing_rate(y, frame_length=N_FFT, hop_length=HOP_LENGTH),
+    }
+
+
+def _add_rhythm(features, onset_envelope, sr):
+    tempo, beats = librosa.beat.beat_track(onset_envelope=onset_envelope, sr=sr, hop_length=HOP_LENGTH)
+    features.update(onset_envelope=onset_envelope, tempo=tempo, beats=beats)
+    return features
+
+
+def _chunk_features(window, sr, skip, count):
+    """
+    Frame features for `count` frames of `window`, starting at frame `skip`.
+    
+    Also returns the positive spectral flux from each kept frame to the
+    next, which is what librosa's onset envelope is built from.
+    """
+    log_mel, features = _frame_features(window, sr)
+    kept = {name: values[..., skip:skip + count] for name, values in features.items()}
+    following = log_mel[:, skip + 1:skip + count + 1]
+    current = log_mel[:, skip:skip + following.shape[1]]
+    kept["flux"] = np.maximum(0.0, following - current).mean(axis=0)
+    return kept
+
+
+def extract_spectral_features_chunked(y, sr, executor):
+    """
+    extract_spectral_features, computed in pieces on `executor`.
+    
+    Every frame is computed by exactly one piece, from the same samples a
+    single pass would use, and the pieces are stitched back in order; beat
+    tracking then runs once on the stitched onset envelope. Values match
+    the single pass except where power_to_db's 80 dB floor falls, which is
+    relative to each piece's loudest frame rather than the whole signal.
+    """
+    n_frames = 1 + len(y) // HOP_LENGTH
+    step = max(int(CHUNK_SECONDS * sr) // HOP_LENGTH, 1)
+    futures = []
+    for first in range(0, n_frames, step):
+        last = min(first + step, n_frames)
+        start = max(first * HOP_LENGTH - CHUNK_CONTEXT, 0)
+        end = min(last * HOP_LENGTH + CHUNK_CONTEXT, len(y))
+        skip = (first * HOP_LENGTH - start) // HOP_LENGTH
+        futures.append(executor.submit(_chunk_features, y[start:end], sr, skip, last - first))
+    
+    pieces = [future.result() for future in futures]
+    features = {name: np.concatenate([piece[name] for piece in pieces], axis=-1)
+                for name in pieces[0] if name != "flux"}
+    flux = np.concatenate([piece["flux"] for piece in pieces])
+    onset_envelope = np.concatenate((np.zeros(ONSET_PAD), flux))[:n_frames]
+    return _add_rhythm(features, onset_envelope, sr)
+
+
+def _segment_praat_measures(segment, sr):
+    try:
+        return praat_measures(parselmouth.Sound(segment.astype(np.float64), sampling_frequency=sr))
+    except parselmouth.PraatError:
+        # Too short or too irregular for Praat; it carries no weight.
+        return dict.fromkeys(PRAAT_MEASURES, float('nan'))
+
+
+def find_speech_segments(rms, sr, hop_length=HOP_LENGTH):
+    """
+    Find speech regions from per-frame RMS energy.
+    
+    Args:
+        rms (np.ndarray): Frame RMS, as returned by librosa.feature.rms
+        sr (int): Sample rate of the signal the frames came from
+        hop_length (int): Samples between frames
+        
+    Returns:
+        list: (start_sample, end_sample) pairs in increasing order
+    """
+    rms = np.asarray(rms).reshape(-1)
+    if rms.size == 0 or not rms.max() > 0:
+        return []
+    voiced = librosa.amplitude_to_db(rms, ref=np.max) > VAD_THRESHOLD_DB
+    
+    # Rising and falling edges of the voiced mask give the raw regions.
+    edges = np.flatnonzero(np.diff(np.concatenate(([0], voiced.astype(np.int8), [0]))))
+    regions = edges.reshape(-1, 2) * hop_length
+    
+    min_pause = int(VAD_MIN_PAUSE * sr)
+    merged = []
+    for start, end in regions:
+        if merged and start - merged[-1][1] < min_pause:
+            merged[-1][1] = end
+        else:
+            merged.append([start, end])
+    
+    pad = int(VAD_PAD * sr)
+    limit = rms.size * hop_length
+    segments = []
+    for start, end in merged:
+        if end - start < VAD_MIN_SPEECH * sr:
+            continue
+        start, end = max(start - pad, 0), min(end + pad, limit)
+        if segments and start <= segments[-1][1]:
+            segments[-1] = (segments[-1][0], end)
+        else:
+            segments.append((start, end))
+    return segments
+
+
+PRAAT_MEASURES = ("mean_f0", "f0_std", "mean_intensity", "jitter_local", "shimmer_local")
+
+
+def praat_measures(snd):
+    """Pitch, intensity, jitter and shimmer of one parselmouth.Sound."""
+    pitch_obj = snd.to_pitch()
+    intensity = snd.to_intensity()
+    # Detect periodic points (glottal pulses)
+    point_process = call(snd, "To PointProcess (periodic, cc)", 75, 500)
+    return {
+        "mean_f0": call(pitch_obj, "Get mean", 0, 0, "Hertz"),
+        "f0_std": call(pitch_obj, "Get standard deviation", 0, 0, "Hertz"),
+        "mean_intensity": call(intensity, "Get mean", 0, 0),
+        # Jitter uses only the PointProcess, shimmer both Sound and PointProcess
+        "jitter_local": call(point_process, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3),
+        "shimmer_local": call([snd, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6),
+    }
+
+
+def _weighted(values, weights):
+    # Duration-weighted mean over the segments Praat could measure.
+    values = np.asarray(values, dtype=np.float64)
+    weights = np.asarray(weights, dtype=np.float64)
+    valid = np.isfinite(values)
+    if not valid.any():
+        return float('nan')
+    return float(np.average(values[valid], weights=weights[valid]))
+
+
+def aggregate_praat(measures, durations):
+    """
+    Combine per-segment Praat measures into recording-level values.
+    
+    Means, jitter and shimmer are weighted by segment duration; the pitch
+    standard deviation is pooled so it also covers spread between segments.
+    """
+    column = lambda key: np.array([m[key] for m in measures], dtype=np.float64)
+    mean_f0 = _weighted(column("mean_f0"), durations)
+    second_moment = _weighted(column("f0_std") ** 2 + column("mean_f0") ** 2, durations)
+    return {
+        "mean_f0": mean_f0,
+        "f0_std": float(np.sqrt(max(second_moment - mean_f0 ** 2, 0.0))),
+        "mean_intensity": _weighted(column("mean_intensity"), durations),
+        "jitter_local": _weighted(column("jitter_local"), durations),
+        "shimmer_local": _weighted(column("shimmer_local"), durations),
+    }
+
+
+def speech_stats(segments, total_samples, sr, onset_count):
+    """Pause and speaking-rate statistics from the speech segments."""
+    durations = np.array([end - start for start, end in segments], dtype=np.float64) / sr
+    pauses = np.array([b[0] - a[1] for a, b in zip(segments, segments[1:])], dtype=np.float64) / sr
+    speech_duration = float(durations.sum())
+    total_duration = total_samples / sr
+    return {
+        "speech_duration": speech_duration,
+        "silence_ratio": 1.0 - speech_duration / total_duration if total_duration > 0 else 0.0,
+        "segment_count": len(segments),
+        "pause_count": len(pauses),
+        "mean_pause": float(pauses.mean()) if len(pauses) else 0.0,
+        "longest_pause": float(pauses.max()) if len(pauses) else 0.0,
+        "segments_per_minute": len(segments) / (total_duration / 60) if total_duration > 0 else 0.0,
+        # Spectral onsets per second of speech, a rough stand-in for syllable rate.
+        "onsets_per_second": onset_count / speech_duration if speech_duration > 0 else 0.0,
+    }
+
+def _split_segments(segments, size):
+    # Long segments become several pieces so Praat work spreads over workers.
+    pieces = []
+    for start, end in segments:
+        while end - start > size:
+            pieces.append((start, start + size))
+            start += size
+        pieces.append((start, end))
+    return pieces
+
+def encode_array(values, dtype=np.float16):
+    """Pack an array as base64 little-endian binary with its dtype and shape."""
+    values = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {
+        "encoding": "base64",
+        "dtype": np.dtype(dtype).name,
+        "shape": list(values.shape),
+        "data": base64.b64encode(values.tobytes()).decode('ascii'),
+    }
+
+def downsample_frames(values, points=SERIES_POINTS):
+    """Average the last (frame) axis into at most `points` equal bins."""
+    values = np.atleast_2d(values)
+    n_frames = values.shape[-1]
+    if n_frames <= points:
+        return values
+    edges = np.linspace(0, n_frames, points + 1).astype(int)
+    sums = np.add.reduceat(values, edges[:-1], axis=-1)
+    return sums / np.diff(edges)
+
+def frame_detail(values, sr, detail):
+    """
+    Per-frame data at `detail` level, or None for "summary".
+    
+    Rounded values are cast to float64 first: float32 rounded to 4 places
+    still prints with every digit once converted to Python floats.
+    
+    Frames cover the speech regions only, laid end to end, so their time
+    axis is seconds of speech; speech_segments maps it back to media time.
+    """
+    if detail == "series":
+        series = downsample_frames(values)
+        frames_per_point = values.shape[-1] / series.shape[-1]
+        return {
+            "seconds_per_point": frames_per_point * HOP_LENGTH / sr,
+            "values": np.round(series.astype(np.float64), 4).tolist(),
+        }
+    if detail == "full":
+        return dict(encode_array(values), seconds_per_frame=HOP_LENGTH / sr)
+    return None
+
+def speech_segments(segments, sr):
+    """
+    Map from the per-frame speech time axis to media time.
+    
+    Each entry is [speech_start, media_start, media_end] in seconds: speech
+    time t in [speech_start, speech_start + media_end - media_start) is
+    media time media_start + (t - speech_start).
+    """
+    mapping = []
+    speech_start = 0.0
+    for start, end in segments:
+        mapping.append([round(speech_start, 4), round(start / sr, 4), round(end / sr, 4)])
+        speech_start += (end - start) / sr
+    return mapping
+
+def _analyze_speech(y, sr, segments, speech, executor=None, trace=None):
+    """
+    Spectral features of the speech, and Praat measures with their weights.
+    
+    Returns:
+        tuple: (features, measures, durations); one measure per Praat piece
+    """
+    trace = trace or Trace()
+    if executor is None:
+        # Extract MFCCs, RMS energy, spectral and rhythm features from one
+        # STFT of the speech regions
+        logger.info("Extracting spectral features")
+        with trace.stage("audio.spectral"):
+            features = extract_spectral_features(speech, sr)
+        # Run Praat on each speech region
+        logger.info("Running Praat on %d speech segments", len(segments))
+        with trace.stage("audio.praat", segments=len(segments)):
+            measures = [_segment_praat_measures(y[start:end], sr) for start, end in segments]
+        return features, measures, [(end - start) / sr for start, end in segments]
+    
+    # Queue the Praat pieces first so they run alongside the spectral chunks.
+    # The work happens in child processes, so only wall time is meaningful.
+    logger.info("Analyzing speech in parallel")
+    pieces = _split_segments(segments, int(CHUNK_SECONDS * sr))
+    with trace.stage("audio.parallel", segments=len(pieces)):
+        praat_futures = [executor.submit(_segment_praat_measures, y[start:end], sr) for start, end in pieces]
+        features = extract_spectral_features_chunked(speech, sr, executor)
+        measures = [future.result() for future in praat_futures]
+    return features, measures, [(end - start) / sr for start, end in pieces]
+
+def analyze_audio_from_mp4(video_path, workers=AUDIO_WORKERS, detail="summary", trace=None):
     """
     Comprehensive audio analysis function for MP4 files.
     Extracts audio features including MFCCs, pitch, intensity, jitter, and shimmer.
     Cross-platform compatible (Windows, macOS, Linux).
     
+    Long recordings are split into chunks and speech segments that are
+    analyzed in parallel on `workers` processes.
+    
     Args:
         video_path (str): Path to the MP4 video file
+        workers (int): Processes for long recordings; 0 runs in-process
+        detail (str): One of DETAIL_LEVELS; how much per-frame MFCC and RMS
+            data to include beyond the summary statistics
+        trace (metrics.Trace): Receives per-stage timings when given
         
     Returns:
         dict: Dictionary containing all audio analysis results
     """
-    import os
-    import tempfile
-    import platform
-    import sys
-    
-    # Create temporary directory for intermediate files
-    with tempfile.TemporaryDirectory() as temp_dir:
-        # Extract audio from video
-        print(f"Extracting audio from {video_path}...")
-        video = VideoFileClip(video_path)
-        audio = video.audio
-        
-        if audio is None:
-            raise ValueError("No audio track found in the video file")
-        
-        # Save audio as WAV file (Windows-compatible path handling)
-        audio_path = os.path.join(temp_dir, "extracted_audio.wav")
-        
-        # Windows-specific audio settings
-        if platform.system() == "Windows":
-            # Use Windows-compatible audio codec
-            audio.write_audiofile(audio_path, fps=16000, verbose=False, logger=None, 
-                                codec='pcm_s16le', ffmpeg_params=['-ac', '1'])  # Mono for better compatibility
-        else:
-            # Standard settings for macOS/Linux
-            audio.write_audiofile(audio_path, fps=16000, verbose=False, logger=None)
-        
-        # Load the audio file
-        print("Loading audio file...")
-        y, sr = librosa.load(audio_path, sr=None)
-        
-        # Extract MFCCs
-        print("Extracting MFCCs...")
-        mfccs = librosa.feature.mfcc(y=y, sr=sr, n_mfcc=13)
-        
-        # Extract RMS energy
-        print("Extracting RMS energy...")
-        rms = librosa.feature.rms(y=y)
-        
-        # Extract pitch using piptrack
-        print("Extracting pitch...")
-        pitch, mag = librosa.piptrack(y=y, sr=sr)
-        
-        # Load audio into Praat-parselmouth for advanced analysis
-        print("Loading audio into Praat...")
-        snd = parselmouth.Sound(audio_path)
-        
-        # Extract pitch object
-        pitch_obj = snd.to_pitch()
-        
-        # Get mean and standard deviation of pitch (fundamental frequency)
-        mean_pitch = call(pitch_obj, "Get mean", 0, 0, "Hertz")
-        stdev_pitch = call(pitch_obj, "Get standard deviation", 0, 0, "Hertz")
+    if detail not in DETAIL_LEVELS:
+        raise ValueError(f"Unknown detail level: {detail}")
+    trace = trace or Trace()
+    
+    # Decode the audio track straight into memory; librosa and Praat both
+    # read the same buffer, so nothing is written to disk.
+    logger.info("Extracting audio from %s", video_path)
+    with trace.stage("audio.decode"):
+        y = decode_audio(video_path, AUDIO_SAMPLE_RATE)
+    sr = AUDIO_SAMPLE_RATE
+    
+    # Find speech with a cheap time-domain RMS pass; silence, pauses and
+    # quiet stretches are skipped by everything below.
+    logger.info("Detecting speech")
+    with trace.stage("audio.vad"):
+        frame_rms = librosa.feature.rms(y=y, frame_length=N_FFT, hop_length=HOP_LENGTH)
+        segments = find_speech_segments(frame_rms, sr) or [(0, len(y))]
+        speech = np.concatenate([y[start:end] for start, end in segments])
+    
+    executor = None
+    if workers > 0 and len(speech) / sr >= CHUNKED_MIN_DURATION:
+        executor = get_executor(workers)
+    try:
+        features, measures, durations = _analyze_speech(y, sr, segments, speech, executor, trace)
+    except BrokenProcessPool:
+        _discard_executor(executor)
+        raise
+    
+    mfccs = features["mfccs"]
+    rms = features["rms"]
+    onsets = librosa.onset.onset_detect(onset_envelope=features["onset_envelope"], sr=sr,
+                                        hop_length=HOP_LENGTH)
+    praat = aggregate_praat(measures, durations)
+    mean_pitch = praat["mean_f0"]
+    stdev_pitch = praat["f0_std"]
+    mean_intensity = praat["mean_intensity"]
+    jitter_local = praat["jitter_local"]
+    shimmer_local = praat["shimmer_local"]
+    
+    # Spectral features
+    spectral_centroids = features["spectral_centroid"]
+    spectral_rolloff = features["spectral_rolloff"]
+    zero_crossing_rate = features["zero_crossing_rate"]
+    
+    # Tempo and rhythm
+    tempo, beats = features["tempo"], features["beats"]
+    
+    # Compile results
+    analysis_results = {
+        # Basic audio properties
+        "duration": len(y) / sr,
+        "sample_rate": sr,
+        "audio_length_samples": len(y),
         
-        # Get intensity (volume)
-        intensity = snd.to_intensity()
-        mean_intensity = call(intensity, "Get mean", 0, 0)
+        # MFCC features
+        "mfccs": {
+            "mean": float(mfccs.mean()),
+            "std": float(mfccs.std()),
+            "shape": list(mfccs.shape),
+            "coefficient_means": np.round(mfccs.mean(axis=1).astype(np.float64), 4).tolist(),
+            "coefficient_stds": np.round(mfccs.std(axis=1).astype(np.float64), 4).tolist()
+        },
         
-        # Detect periodic points (glottal pulses)
-        point_process = call(snd, "To PointProcess (periodic, cc)", 75, 500)
+        # RMS energy
+        "rms_energy": {
+            "mean": float(rms.mean()),
+            "std": float(rms.std()),
+            "max": float(rms.max()),
+            "min": float(rms.min())
+        },
         
-        # Compute jitter (uses only PointProcess)
-        jitter_local = call(point_process, "Get jitter (local)", 0, 0, 0.0001, 0.02, 1.3)
+        # Pitch analysis
+        "pitch": {
+            "mean_f0": float(mean_pitch),
+            "f0_std": float(stdev_pitch),
+            "f0_range": float(mean_pitch + stdev_pitch) - float(mean_pitch - stdev_pitch)
+        },
         
-        # Compute shimmer (uses both Sound and PointProcess)
-        shimmer_local = call([snd, point_process], "Get shimmer (local)", 0, 0, 0.0001, 0.02, 1.3, 1.6)
+        # Intensity analysis
+        "intensity": {
+            "mean_db": float(mean_intensity),
+            "mean_linear": float(10 ** (mean_intensity / 10))  # Convert dB to linear
+        },
         
-        # Additional audio features
-        print("Computing additional features...")
+        # Voice quality measures
+        "voice_quality": {
+            "jitter_local": float(jitter_local),
+            "shimmer_local": float(shimmer_local)
+        },
         
         # Spectral features
-        spectral_centroids = librosa.feature.spectral_centroid(y=y, sr=sr)
-        spectral_rolloff = librosa.feature.spectral_rolloff(y=y, sr=sr)
-        zero_crossing_rate = librosa.feature.zero_crossing_rate(y)
+        "spectral_features": {
+            "spectral_centroid_mean": float(spectral_centroids.mean()),
+            "spectral_rolloff_mean": float(spectral_rolloff.mean()),
+            "zero_crossing_rate_mean": float(zero_crossing_rate.mean())
+        },
         
-        # Tempo and rhythm
-        tempo, beats = librosa.beat.beat_track(y=y, sr=sr)
+        # Speech activity, pauses and speaking rate
+        "speech": speech_stats(segments, len(y), sr, len(onsets)),
         
-        # Compile results
-        analysis_results = {
-            # Basic audio properties
-            "duration": len(y) / sr,
-            "sample_rate": sr,
-            "audio_length_samples": len(y),
-            
-            # MFCC features
-            "mfccs": {
-                "mean": float(mfccs.mean()),
-                "std": float(mfccs.std()),
-                "shape": mfccs.shape,
-                "coefficients": mfccs.tolist()  # Convert to list for JSON serialization
-            },
-            
-            # RMS energy
-            "rms_energy": {
-                "mean": float(rms.mean()),
-                "std": float(rms.std()),
-                "max": float(rms.max()),
-                "min": float(rms.min())
-            },
-            
-            # Pitch analysis
-            "pitch": {
-                "mean_f0": float(mean_pitch),
-                "f0_std": float(stdev_pitch),
-                "f0_range": float(mean_pitch + stdev_pitch) - float(mean_pitch - stdev_pitch)
-            },
-            
-            # Intensity analysis
-            "intensity": {
-                "mean_db": float(mean_intensity),
-                "mean_linear": float(10 ** (mean_intensity / 10))  # Convert dB to linear
-            },
-            
-            # Voice quality measures
-            "voice_quality": {
-                "jitter_local": float(jitter_local),
-                "shimmer_local": float(shimmer_local)
-            },
-            
-            # Spectral features
-            "spectral_features": {
-                "spectral_centroid_mean": float(spectral_centroids.mean()),
-                "spectral_rolloff_mean": float(spectral_rolloff.mean()),
-                "zero_crossing_rate_mean": float(zero_crossing_rate.mean())
-            },
-            
-            # Rhythm and tempo
-            "rhythm": {
-                "tempo_bpm": float(tempo),
-                "beat_count": len(beats)
-            },
-            
-            # Analysis metadata
-            "analysis_info": {
-                "video_file": video_path,
-                "audio_extracted_to": audio_path,
-                "analysis_timestamp": str(pd.Timestamp.now()),
-                "libraries_used": ["librosa", "parselmouth", "moviepy"]
-            }
-        }
+        # Rhythm and tempo
+        "rhythm": {
+            "tempo_bpm": float(tempo),
+            "beat_count": len(beats)
+        },
         
-        print("Audio analysis completed successfully!")
-        return analysis_results
+        # Analysis metadata
+        "analysis_info": {
+            "video_file": video_path,
+            "analysis_timestamp": str(datetime.now()),
+            "libraries_used": ["librosa", "parselmouth", "ffmpeg"]
+        }
+    }
+    
+    if detail != "summary":
+        analysis_results["mfccs"]["coefficients"] = frame_detail(mfccs, sr, detail)
+        analysis_results["rms_energy"]["frames"] = frame_detail(rms, sr, detail)
+        analysis_results["speech"]["segments"] = speech_segments(segments, sr)
+    
+    logger.info("Audio analysis completed")
+    return analysis_results
 
 # Example usage:
 # results = analyze_audio_from_mp4("interview.mp4")
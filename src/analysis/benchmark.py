@@ -0,0 +1,262 @@
+"""Benchmark the analyzers and the API path on fixed inputs.
+
+Runs hand, mood and audio analysis and the full POST /api/analysis path
+against interview.mp4 and variants generated from it with ffmpeg: a long
+one (the clip looped) and a 1080p one. Each target/variant pair runs in a
+fresh process so peak memory is its own. The report is JSON: throughput,
+per-stage latency percentiles from metrics.Trace, peak RSS, and drift of
+the results against a golden file written by an earlier run.
+
+    python benchmark.py --repeat 5 --output bench.json
+    python benchmark.py --write-golden golden.json
+    python benchmark.py --golden golden.json --targets hand mood
+
+The motion gate in video.py is off by default. To check it, write the
+golden file ungated and compare an ANALYSIS_MOTION_GATE=1 run against it
+with a looser --tolerance; the gate should keep aggregate scores within
+0.05 of ungated ones before it is turned on.
+--decoder runs the video targets on the "opencv" or "ffmpeg" frame source;
+ffmpeg decodes in a child process, so compare child_cpu as well as stages.
+"""
+import argparse
+import functools
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+API_DIR = os.path.join(HERE, '..', '..', 'api', 'python')
+
+SOURCE_VIDEO = os.path.join(HERE, 'interview.mp4')
+VARIANT_DIR = os.path.join(HERE, '.benchmark')
+
+TARGETS = ("hand", "mood", "audio", "api")
+VARIANTS = ("interview", "long", "hires")
+
+# Times the clip is repeated for the "long" variant.
+LONG_LOOPS = 20
+HIRES_WIDTH = 1920
+
+PERCENTILES = (50, 90, 99)
+
+# Relative difference above which a numeric result counts as drifted.
+DRIFT_TOLERANCE = 1e-3
+
+# Parts of a result that change from run to run by design.
+VOLATILE_KEYS = {"analysis_info", "metrics"}
+
+
+def _ffmpeg(args):
+    from media import find_ffmpeg
+
+    subprocess.run([find_ffmpeg(), '-hide_banner', '-loglevel', 'error', '-y'] + args, check=True)
+
+
+def variant_path(name: str) -> str:
+    """Return the path of input variant `name`, generating it on first use.
+
+    Generated variants are kept in VARIANT_DIR and reused, so every run of
+    the suite measures byte-identical inputs.
+    """
+    if name == "interview":
+        return SOURCE_VIDEO
+    os.makedirs(VARIANT_DIR, exist_ok=True)
+    path = os.path.join(VARIANT_DIR, f'{name}.mp4')
+    if os.path.exists(path):
+        return path
+    tmp_path = path + '.tmp.mp4'
+    if name == "long":
+        _ffmpeg(['-stream_loop', str(LONG_LOOPS - 1), '-i', SOURCE_VIDEO, '-c', 'copy', tmp_path])
+    elif name == "hires":
+        _ffmpeg(['-i', SOURCE_VIDEO, '-vf', f'scale={HIRES_WIDTH}:-2:flags=bicubic',
+                 '-c:v', 'libx264', '-preset', 'veryfast', '-crf', '18', '-c:a', 'copy', tmp_path])
+    else:
+        raise ValueError(f"Unknown variant: {name}")
+    os.replace(tmp_path, path)
+    return path
+
+
+@functools.lru_cache(maxsize=None)
+def _file_server(directory: str) -> str:
+    # The API path downloads over HTTP, so serve the inputs locally.
+    handler = functools.partial(QuietHandler, directory=directory)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f'http://127.0.0.1:{server.server_port}'
+
+
+class QuietHandler(SimpleHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+
+def _run_once(target, path, trace):
+    if target in ("hand", "mood"):
+        from video import analyze
+
+        return analyze(path, modes=(target,), trace=trace)[target].to_dict()
+    if target == "audio":
+        from audio import analyze_audio_from_mp4
+
+        return analyze_audio_from_mp4(path, trace=trace)
+    if target == "api":
+        import route
+
+        url = f'{_file_server(os.path.dirname(path))}/{os.path.basename(path)}'
+        response = route.app.test_client().post('/api/analysis', json={
+            "videoUrl": url, "mode": "all", "metrics": True,
+        })
+        payload = response.get_json()
+        trace.merge(payload.pop("metrics", {}))
+        return payload
+    raise ValueError(f"Unknown target: {target}")
+
+
+def run_case(target: str, variant: str, repeat: int) -> dict:
+    """Run one target on one variant `repeat` times; executed in a fresh process."""
+    if target == "api":
+        # Every repeat has to do the work, and the pool would hide it in
+        # other processes' memory.
+        os.environ["ANALYSIS_CACHE"] = "off"
+        os.environ["ANALYSIS_WORKERS"] = "0"
+        sys.path.insert(0, os.path.abspath(API_DIR))
+    import numpy as np
+    from metrics import Trace, peak_rss, child_cpu
+
+    path = variant_path(variant)
+    # One untimed run so model loading and imports are not measured.
+    _run_once(target, path, Trace())
+
+    runs = []
+    result = None
+    child_started = child_cpu()
+    for _ in range(repeat):
+        trace = Trace()
+        started = time.perf_counter()
+        result = _run_once(target, path, trace)
+        runs.append((time.perf_counter() - started, trace.to_dict()))
+
+    walls = np.array([wall for wall, _ in runs])
+    stage_names = sorted({name for _, stages in runs for name in stages})
+    stages = {}
+    for name in stage_names:
+        recorded = [trace_stages[name] for _, trace_stages in runs if name in trace_stages]
+        samples = np.array([stage["wall"] for stage in recorded])
+        frames = [stage["frames"] for stage in recorded]
+        stages[name] = {f"p{p}": float(np.percentile(samples, p)) for p in PERCENTILES}
+        stages[name]["frames"] = int(np.median(frames))
+        if "inferences" in recorded[0]:
+            stages[name]["inferences"] = int(np.median([stage["inferences"] for stage in recorded]))
+    frames = stages.get("decode", {}).get("frames", 0)
+
+    return {
+        "target": target,
+        "variant": variant,
+        "repeat": repeat,
+        "wall": {f"p{p}": float(np.percentile(walls, p)) for p in PERCENTILES},
+        "frames_per_second": frames / float(np.median(walls)) if frames else None,
+        "stages": stages,
+        "peak_rss": peak_rss(),
+        # CPU of finished ffmpeg processes, per repeat.
+        "child_cpu": (child_cpu() - child_started) / repeat,
+        "result": result,
+    }
+
+
+def drift(result, golden, path="", tolerance=DRIFT_TOLERANCE):
+    """Return {path: {"got", "want"}} for every leaf of `result` that moved."""
+    if isinstance(golden, dict) and isinstance(result, dict):
+        changes = {}
+        for key in set(golden) | set(result):
+            if key in VOLATILE_KEYS:
+                continue
+            changes.update(drift(result.get(key), golden.get(key), f"{path}.{key}" if path else key, tolerance))
+        return changes
+    if isinstance(golden, list) and isinstance(result, list) and len(golden) == len(result):
+        changes = {}
+        for index, (got, want) in enumerate(zip(result, golden)):
+            changes.update(drift(got, want, f"{path}[{index}]", tolerance))
+        return changes
+    numeric = (int, float)
+    if isinstance(golden, numeric) and isinstance(result, numeric) and not isinstance(golden, bool):
+        scale = max(abs(golden), abs(result), 1e-12)
+        if abs(result - golden) / scale <= tolerance:
+            return {}
+    elif result == golden:
+        return {}
+    return {path: {"got": result, "want": golden}}
+
+
+def environment() -> dict:
+    try:
+        commit = subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=HERE, capture_output=True,
+                                text=True).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "decoder": os.environ.get("ANALYSIS_DECODER", "opencv"),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument('--targets', nargs='+', choices=TARGETS, default=list(TARGETS))
+    parser.add_argument('--variants', nargs='+', choices=VARIANTS, default=list(VARIANTS))
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--decoder', choices=("opencv", "ffmpeg"), help="frame-source backend for video targets")
+    parser.add_argument('--golden', help="compare results against this golden file")
+    parser.add_argument('--tolerance', type=float, default=DRIFT_TOLERANCE,
+                        help="relative difference allowed against the golden file")
+    parser.add_argument('--write-golden', help="write this run's results as the golden file")
+    parser.add_argument('--output', help="write the report here instead of stdout")
+    args = parser.parse_args(argv)
+    if args.decoder:
+        # Spawned case processes inherit this.
+        os.environ["ANALYSIS_DECODER"] = args.decoder
+
+    golden = {}
+    if args.golden:
+        with open(args.golden) as f:
+            golden = json.load(f)
+
+    cases = []
+    context = multiprocessing.get_context("spawn")
+    for variant in args.variants:
+        for target in args.targets:
+            with ProcessPoolExecutor(max_workers=1, mp_context=context) as executor:
+                case = executor.submit(run_case, target, variant, args.repeat).result()
+            key = f"{target}/{variant}"
+            if key in golden:
+                case["drift"] = drift(case["result"], golden[key], tolerance=args.tolerance)
+            cases.append(case)
+            print(f"{key}: p50 {case['wall']['p50']:.3f}s", file=sys.stderr)
+
+    report = {"environment": environment(), "cases": cases}
+    if args.write_golden:
+        with open(args.write_golden, 'w') as f:
+            json.dump({f"{c['target']}/{c['variant']}": c["result"] for c in cases}, f, indent=2, sort_keys=True)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+    else:
+        print(text)
+    # A non-zero exit lets CI flag result drift.
+    return 1 if any(case.get("drift") for case in cases) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,284 @@
+"""Content-addressed cache of analyzer results.
+
+Entries are keyed by a hash of the video bytes plus everything that can
+change an analyzer's output: its tuning constants, its model options, the
+sampling rate (or, for audio, the detail level) and its VERSION. Each analyzer has its own key, so a change
+to the hand parameters leaves cached mood results valid and vice versa.
+Results are stored as JSON in a size-bounded, least-recently-used backend
+on local disk or in SQLite.
+"""
+import dataclasses
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import config
+import models
+from config import HandParams, MoodParams, HandResult, MoodResult
+from engine import AUDIO_WORKERS
+from media import AUDIO_SAMPLE_RATE, DEFAULT_DECODER
+
+
+# "disk", "sqlite" or "off".
+BACKEND = os.environ.get("ANALYSIS_CACHE", "disk")
+CACHE_PATH = os.environ.get("ANALYSIS_CACHE_PATH", os.path.join(tempfile.gettempdir(), "analysis-cache"))
+MAX_BYTES = int(os.environ.get("ANALYSIS_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+HASH_CHUNK = 1024 * 1024
+
+def hash_file(path: str) -> str:
+    """Return the SHA-256 hex digest of the file at `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def analyzer_config(name: str, sample_rate=None, decoder=None, detail=None) -> dict:
+    """Return every parameter that affects the result of analyzer `name`."""
+    if name == "audio":
+        return {
+            "version": config.AUDIO_VERSION,
+            "sample_rate": AUDIO_SAMPLE_RATE,
+            "n_fft": config.N_FFT,
+            "hop_length": config.HOP_LENGTH,
+            "n_mfcc": config.N_MFCC,
+            "vad": {
+                "threshold_db": config.VAD_THRESHOLD_DB,
+                "min_pause": config.VAD_MIN_PAUSE,
+                "min_speech": config.VAD_MIN_SPEECH,
+                "pad": config.VAD_PAD,
+            },
+            # Chunked extraction matches the single pass only to within the
+            # dB floor, so whether it can run is part of the key.
+            "chunked": {
+                "min_duration": config.CHUNKED_MIN_DURATION,
+                "seconds": config.CHUNK_SECONDS,
+                "context": config.CHUNK_CONTEXT,
+            } if AUDIO_WORKERS > 0 else None,
+            "detail": detail or "summary",
+            "series_points": config.SERIES_POINTS,
+        }
+
+    # The backends scale with different filters, so results differ slightly.
+    decoder = decoder or DEFAULT_DECODER
+    gate = None
+    if config.MOTION_GATE:
+        gate = {
+            "thumb_width": config.GATE_THUMB_WIDTH,
+            "pixel_delta": config.GATE_PIXEL_DELTA,
+            "changed_fraction": config.GATE_CHANGED_FRACTION,
+            "max_interval": config.GATE_MAX_INTERVAL,
+        }
+
+    if name == "hand":
+        return {
+            "version": HandParams.VERSION,
+            "process_width": config.PROCESS_WIDTH,
+            "frame_skip_rate": HandParams.FRAME_SKIP_RATE,
+            "movement_threshold": HandParams.MOVEMENT_THRESHOLD,
+            "calibration_duration": HandParams.CALIBRATION_DURATION,
+            "baseline_window": HandParams.BASELINE_WINDOW,
+            "wrist_landmark": HandParams.WRIST_LANDMARK,
+            "model": models.HAND_MODEL_OPTIONS,
+            "decoder": decoder,
+            "motion_gate": gate,
+            "sample_rate": sample_rate,
+        }
+    if name == "mood":
+        return {
+            "version": MoodParams.VERSION,
+            "process_width": config.PROCESS_WIDTH,
+            "frame_skip_rate": MoodParams.FRAME_SKIP_RATE,
+            "positive_threshold": MoodParams.POSITIVE_THRESHOLD,
+            "negative_threshold": MoodParams.NEGATIVE_THRESHOLD,
+            "model": models.FACE_MESH_OPTIONS,
+            "decoder": decoder,
+            "motion_gate": gate,
+            "face_roi": {
+                "detail_width": config.ROI_DETAIL_WIDTH,
+                "input_size": config.ROI_INPUT_SIZE,
+                "margin": config.ROI_MARGIN,
+                "min_size": config.ROI_MIN_SIZE,
+            } if config.FACE_ROI else None,
+            "sample_rate": sample_rate,
+        }
+    raise ValueError(f"Unknown analyzer: {name}")
+
+
+def cache_key(video_hash: str, name: str, sample_rate=None, decoder=None, detail=None) -> str:
+    params = json.dumps(analyzer_config(name, sample_rate, decoder, detail), sort_keys=True)
+    return hashlib.sha256(f"{video_hash}:{name}:{params}".encode()).hexdigest()
+
+
+class DiskBackend:
+    """One JSON file per entry; file mtimes record recency of use."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(path, exist_ok=True)
+
+    def _entry(self, key):
+        return os.path.join(self.path, key + '.json')
+
+    def get(self, key):
+        path = self._entry(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+            os.utime(path)
+        except OSError:
+            return None
+        return value
+
+    def set(self, key, value: bytes):
+        path = self._entry(key)
+        with self._lock:
+            # Write then rename so readers never see a partial entry.
+            fd, tmp_path = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+            self._evict()
+
+    def _evict(self):
+        entries = []
+        total = 0
+        for entry in os.scandir(self.path):
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.unlink(path)
+            except OSError:
+                pass
+            total -= size
+
+    def clear(self):
+        with self._lock:
+            for entry in os.scandir(self.path):
+                if entry.name.endswith('.json'):
+                    os.unlink(entry.path)
+
+
+class SQLiteBackend:
+    """Entries in a single SQLite table with a last-access timestamp."""
+
+    def __init__(self, path=CACHE_PATH, max_bytes=MAX_BYTES):
+        if not path.endswith('.sqlite'):
+            os.makedirs(path, exist_ok=True)
+            path = os.path.join(path, 'results.sqlite')
+        self.path = path
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._conn:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, value BLOB, size INTEGER, accessed REAL)"
+            )
+            self._conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def get(self, key):
+        with self._lock, self._conn:
+            row = self._conn.execute("SELECT value FROM results WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            self._conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def set(self, key, value: bytes):
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, accessed) VALUES (?, ?, ?, ?)",
+                (key, value, len(value), time.time()),
+            )
+            total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+            if total <= self.max_bytes:
+                return
+            for old_key, size in self._conn.execute(
+                    "SELECT key, size FROM results ORDER BY accessed").fetchall():
+                if total <= self.max_bytes:
+                    break
+                self._conn.execute("DELETE FROM results WHERE key = ?", (old_key,))
+                total -= size
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM results")
+
+
+BACKENDS = {"disk": DiskBackend, "sqlite": SQLiteBackend}
+
+
+class ResultCache:
+    """Looks up and stores typed analyzer results by video hash and config."""
+
+    def __init__(self, backend):
+        self.backend = backend
+
+    def get(self, video_hash, modes, sample_rates=None, decoder=None):
+        """Return {name: result} for the analyzers in `modes` that are cached."""
+        result_types = {"hand": HandResult, "mood": MoodResult}
+        sample_rates = sample_rates or {}
+        results = {}
+        for name in modes:
+            try:
+                value = self.backend.get(cache_key(video_hash, name, sample_rates.get(name), decoder))
+            except Exception:
+                continue
+            if value is None:
+                continue
+            try:
+                results[name] = result_types[name](**json.loads(value))
+            except (TypeError, ValueError):
+                # Written by an incompatible version of the result type.
+                continue
+        return results
+
+    def put(self, video_hash, results, sample_rates=None, decoder=None):
+        sample_rates = sample_rates or {}
+        for name, result in results.items():
+            value = json.dumps(dataclasses.asdict(result)).encode()
+            try:
+                self.backend.set(cache_key(video_hash, name, sample_rates.get(name), decoder), value)
+            except Exception:
+                # A cache that cannot be written only costs a recompute.
+                pass
+
+    def get_audio(self, video_hash, detail="summary"):
+        """Return the cached audio analysis dict at `detail` level, or None."""
+        try:
+            value = self.backend.get(cache_key(video_hash, "audio", detail=detail))
+        except Exception:
+            return None
+        return json.loads(value) if value is not None else None
+
+    def put_audio(self, video_hash, result, detail="summary"):
+        try:
+            self.backend.set(cache_key(video_hash, "audio", detail=detail), json.dumps(result).encode())
+        except Exception:
+            pass
+
+
+def open_cache(backend=BACKEND, path=CACHE_PATH, max_bytes=MAX_BYTES):
+    """Return a ResultCache for `backend`, or None when caching is off."""
+    if backend == "off":
+        return None
+    return ResultCache(BACKENDS[backend](path, max_bytes))
@@ -0,0 +1,123 @@
+"""Analyzer parameters and result types, without the analyzers themselves.
+
+The API process needs these for cache keys, request defaults and cached
+results, but not OpenCV, MediaPipe, librosa or NumPy; those load with
+video.py and audio.py in whichever process actually runs the analysis. The
+analyzers in video.py take their tuning constants from the *Params classes
+here, and audio.py its module constants.
+"""
+import os
+from dataclasses import dataclass
+
+
+PROCESS_WIDTH = 240
+
+# Samples per second of media time used when an analyzer runs in time-based
+# sampling mode. At 30 fps these match the legacy FRAME_SKIP_RATE strides.
+DEFAULT_SAMPLE_RATES = {
+    "hand": 1.0,
+    "mood": 3.0,
+}
+
+# Motion gate: a sampled frame only goes to the model when its grayscale
+# thumbnail differs from the last inferred one in at least
+# GATE_CHANGED_FRACTION of its pixels (by more than GATE_PIXEL_DELTA levels),
+# or GATE_MAX_INTERVAL seconds of media have passed. Otherwise the previous
+# landmarks are reused. Off by default: ANALYSIS_MOTION_GATE=1 turns it on
+# once benchmark.py's tolerance check passes on representative uploads.
+MOTION_GATE = os.environ.get("ANALYSIS_MOTION_GATE", "0") == "1"
+GATE_THUMB_WIDTH = 64
+GATE_PIXEL_DELTA = 12
+GATE_CHANGED_FRACTION = 0.004
+GATE_MAX_INTERVAL = 2.0
+
+# Face ROI mode for the mood analyzer: once a face is found, FaceMesh runs on
+# a square crop around it, taken from a copy of the frame ROI_DETAIL_WIDTH
+# pixels wide and scaled to the model's ROI_INPUT_SIZE input, instead of on
+# the whole PROCESS_WIDTH frame. The whole frame is only searched again when
+# the face is lost. ANALYSIS_FACE_ROI=0 always uses the whole frame.
+FACE_ROI = os.environ.get("ANALYSIS_FACE_ROI", "1") == "1"
+ROI_DETAIL_WIDTH = 640
+ROI_INPUT_SIZE = 192
+# Added around the landmark bounding box on each side, as a share of its size.
+ROI_MARGIN = 0.25
+ROI_MIN_SIZE = 16
+
+
+# Audio analysis (audio.py). Bump AUDIO_VERSION when a change alters its
+# results, so cached entries are recomputed.
+AUDIO_VERSION = 3
+
+# STFT settings shared by every spectral feature (librosa's defaults).
+N_FFT = 2048
+HOP_LENGTH = 512
+N_MFCC = 13
+
+# Voice activity detection on frame RMS. Frames within VAD_THRESHOLD_DB of
+# the loudest frame count as speech; pauses shorter than VAD_MIN_PAUSE are
+# bridged, bursts shorter than VAD_MIN_SPEECH dropped, and every region is
+# padded by VAD_PAD seconds so onsets and decays are kept.
+VAD_THRESHOLD_DB = -35.0
+VAD_MIN_PAUSE = 0.3
+VAD_MIN_SPEECH = 0.25
+VAD_PAD = 0.1
+
+# Recordings with more speech than CHUNKED_MIN_DURATION seconds are split
+# into CHUNK_SECONDS pieces and analyzed on a pool of AUDIO_WORKERS
+# processes (ANALYSIS_AUDIO_WORKERS, see engine.py; 0 keeps everything in
+# this process). Each piece carries CHUNK_CONTEXT samples of real signal on
+# both sides so frames near a cut see the same samples as in a single pass.
+CHUNKED_MIN_DURATION = 120.0
+CHUNK_SECONDS = 60.0
+CHUNK_CONTEXT = N_FFT
+
+# How much of the per-frame MFCC and RMS data goes into the result:
+# "summary" only statistics, "series" downsampled to at most SERIES_POINTS
+# columns, "full" every frame as base64-encoded float16.
+DETAIL_LEVELS = ("summary", "series", "full")
+SERIES_POINTS = 300
+
+
+class HandParams:
+    """Tuning of video.HandAnalyzer."""
+    # Bump when a change alters results, so cached entries are recomputed.
+    VERSION = 4
+    # Seconds of media time, from the first frame, used for the baseline.
+    CALIBRATION_DURATION = 2.0
+    FRAME_SKIP_RATE = 30
+    MOVEMENT_THRESHOLD = 0.05
+    WRIST_LANDMARK = 0
+    # With a positive value each tracked sample is compared with the mean
+    # wrist height over this many preceding seconds of media time instead of
+    # the fixed calibration baseline (which still covers empty windows).
+    # Set with ANALYSIS_BASELINE_WINDOW; 0 keeps the fixed baseline.
+    BASELINE_WINDOW = float(os.environ.get("ANALYSIS_BASELINE_WINDOW", "0"))
+
+
+class MoodParams:
+    """Tuning of video.MoodAnalyzer."""
+    VERSION = 3
+    FRAME_SKIP_RATE = 10
+    POSITIVE_THRESHOLD = 0.75
+    NEGATIVE_THRESHOLD = 0.45
+
+
+@dataclass
+class HandResult:
+    """Share of tracked frames where the wrist moved past the threshold."""
+    score: float = 0.0
+    detected: bool = False
+
+    def to_dict(self):
+        return {"hand": self.score}
+
+
+@dataclass
+class MoodResult:
+    """Overall mood label and the averaged mouth/eye width ratio."""
+    label: str = "OVERALL: Unknown"
+    score: float = 0.0
+    detected: bool = False
+
+    def to_dict(self):
+        return {"mood": self.label, "score": self.score}
@@ -0,0 +1,204 @@
+"""Process-pool execution backend for CPU-bound analysis.
+
+The per-frame Python work in the analyzers holds the GIL, so running them on
+threads keeps a many-core box mostly idle. AnalysisEngine runs analysis in a
+pool of long-lived worker processes that load their MediaPipe graphs once,
+and rebuilds the pool if a worker dies (for example a native crash inside a
+model) instead of taking the server down with it.
+"""
+import multiprocessing
+import os
+import sys
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+
+WORKERS = int(os.environ.get("ANALYSIS_WORKERS", os.cpu_count() or 1))
+
+# Workers are replaced after this many tasks to bound native memory growth.
+MAX_TASKS_PER_WORKER = int(os.environ.get("ANALYSIS_MAX_TASKS_PER_WORKER", "100"))
+
+# Processes audio analysis may fan out to for long recordings (see audio.py).
+# Kept small when this pool already uses every core; without the pool the
+# audio analysis has the machine to itself.
+AUDIO_WORKERS = int(os.environ.get("ANALYSIS_AUDIO_WORKERS", 2 if WORKERS > 0 else os.cpu_count() or 1))
+
+
+def _init_worker():
+    import models
+
+    # A worker runs one task at a time, so one graph of each kind is enough.
+    models.configure(1)
+    models.warm_up()
+
+
+# Task functions return (result, stages) so timings recorded in the worker
+# reach the caller's metrics.Trace.
+
+def _analyze(video_file, modes, sample_rates, features_path=None, decoder=None):
+    from metrics import Trace
+    from video import analyze
+
+    trace = Trace()
+    results = analyze(video_file, modes=modes, sample_rates=sample_rates, features_path=features_path,
+                      decoder=decoder, trace=trace)
+    return results, trace.to_dict()
+
+
+def _analyze_audio(path, workers, detail):
+    from audio import analyze_audio_from_mp4
+    from metrics import Trace
+
+    trace = Trace()
+    return analyze_audio_from_mp4(path, workers, detail, trace=trace), trace.to_dict()
+
+
+def _analyze_url(url, dest_path, modes, sample_rates):
+    from metrics import Trace
+    from streaming import analyze_url
+
+    trace = Trace()
+    return analyze_url(url, dest_path, modes=modes, sample_rates=sample_rates, trace=trace), trace.to_dict()
+
+
+def _warm_up(modules):
+    # The initializer has already built the models; this loads the rest.
+    import importlib
+
+    for module in modules:
+        importlib.import_module(module)
+    return None, {}
+
+
+def _unpack(future, trace):
+    result, stages = future.result()
+    if trace is not None:
+        trace.merge(stages)
+    return result
+
+
+class AnalysisEngine:
+    """Runs analysis tasks across a pool of warm worker processes."""
+
+    def __init__(self, workers=WORKERS, max_tasks_per_worker=MAX_TASKS_PER_WORKER):
+        self.workers = workers
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self._executor = None
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                options = {}
+                # Worker recycling needs Python 3.11; older runtimes keep
+                # their workers for the life of the pool.
+                if sys.version_info >= (3, 11):
+                    options["max_tasks_per_child"] = self.max_tasks_per_worker
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_init_worker,
+                    **options,
+                )
+            return self._executor
+
+    @property
+    def idle(self):
+        """Workers not busy with, or about to take, a submitted task."""
+        with self._lock:
+            return max(self.workers - self._pending, 0)
+
+    def _finished(self, future):
+        with self._lock:
+            self._pending -= 1
+
+    def _recycle(self, executor):
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def submit(self, fn, *args, retries=1):
+        """Schedule `fn(*args)` on a worker and return a Future for its result.
+
+        If the pool breaks because a worker died, the pool is rebuilt and the
+        task resubmitted up to `retries` times before the error is reported.
+        """
+        outer = Future()
+        with self._lock:
+            self._pending += 1
+        outer.add_done_callback(self._finished)
+
+        def attempt(remaining):
+            executor = self._get_executor()
+            try:
+                inner = executor.submit(fn, *args)
+            except BrokenProcessPool as e:
+                self._recycle(executor)
+                if remaining:
+                    attempt(remaining - 1)
+                else:
+                    outer.set_exception(e)
+                return
+
+            def done(f):
+                exc = f.exception()
+                if isinstance(exc, BrokenProcessPool):
+                    self._recycle(executor)
+                    if remaining:
+                        attempt(remaining - 1)
+                        return
+                if exc is not None:
+                    outer.set_exception(exc)
+                else:
+                    outer.set_result(f.result())
+
+            inner.add_done_callback(done)
+
+        attempt(retries)
+        return outer
+
+    def analyze(self, video_file, modes=("mood", "hand"), sample_rates=None, split=None, features_path=None,
+                decoder=None, trace=None):
+        """Run video analyzers on a worker and return {name: result}.
+
+        Analyzers normally share one decode inside a single worker. Split,
+        each analyzer gets its own worker, trading a second decode for more
+        cores on a single request. By default (`split=None`) that happens
+        only when enough workers are idle to take every analyzer at once.
+        Timings from the worker are merged into `trace` when given.
+        """
+        if split is None:
+            split = self.idle >= len(modes)
+        if not split or len(modes) < 2:
+            return _unpack(self.submit(_analyze, video_file, tuple(modes), sample_rates, features_path, decoder), trace)
+        futures = [self.submit(_analyze, video_file, (mode,), sample_rates, features_path, decoder) for mode in modes]
+        results = {}
+        for future in futures:
+            results.update(_unpack(future, trace))
+        return results
+
+    def analyze_url(self, url, dest_path, modes=("mood", "hand"), sample_rates=None, trace=None):
+        """Download and analyze `url` concurrently on a worker (see streaming.py)."""
+        return _unpack(self.submit(_analyze_url, url, dest_path, tuple(modes), sample_rates), trace)
+
+    def analyze_audio(self, path, detail="summary", workers=AUDIO_WORKERS, trace=None):
+        """Run the audio analysis on a worker and return its summary dict."""
+        return _unpack(self.submit(_analyze_audio, path, workers, detail), trace)
+
+    def warm_up(self, modules=("video", "audio")):
+        """Start the workers and have each import `modules` ahead of the first request.
+
+        One task is queued per worker; the pool starts a process for each,
+        and the initializer builds that process's models.
+        """
+        for future in [self.submit(_warm_up, tuple(modules)) for _ in range(self.workers)]:
+            future.result()
+
+    def shutdown(self, wait=True):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait)
@@ -0,0 +1,87 @@
+"""Per-sample feature records and re-scoring without re-decoding.
+
+The analyzers keep one row per sampled frame (timestamp, wrist position,
+mouth and eye landmarks, detection flags) and score them in one vectorized
+pass. save_features writes those rows as compressed NumPy columns; the
+score_* functions run the same scoring over a saved record. Retuning a
+threshold over an archive of interviews then only reads these files.
+"""
+import json
+import os
+import sys
+import tempfile
+
+import numpy as np
+
+from video import HandAnalyzer, MoodAnalyzer, HandResult, MoodResult
+
+
+def save_features(path: str, analyzer) -> None:
+    """Write `analyzer`'s recorded samples and metadata to `path` (.npz)."""
+    columns, meta = analyzer.features()
+    meta = dict(meta, name=analyzer.name, version=analyzer.VERSION,
+                sample_rate=analyzer.sample_rate, frame_skip_rate=analyzer.FRAME_SKIP_RATE)
+    # Write then rename so readers never see a partial record; the temp name
+    # is unique so concurrent requests for the same video do not collide.
+    fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path) or '.', suffix='.tmp.npz')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            np.savez_compressed(f, meta=np.array(json.dumps(meta)), **columns)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.unlink(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def load_features(path: str):
+    """Return (columns, meta) as written by save_features."""
+    with np.load(path) as data:
+        columns = {key: data[key] for key in data.files if key != 'meta'}
+        meta = json.loads(str(data['meta']))
+    return columns, meta
+
+
+def score_hand(columns, meta, movement_threshold=HandAnalyzer.MOVEMENT_THRESHOLD,
+               baseline_window=HandAnalyzer.BASELINE_WINDOW) -> HandResult:
+    """Recompute HandAnalyzer.result() from a feature record."""
+    return HandAnalyzer.score(columns, meta["total_frames"], movement_threshold, baseline_window)
+
+
+def score_mood(columns, meta, positive=MoodAnalyzer.POSITIVE_THRESHOLD,
+               negative=MoodAnalyzer.NEGATIVE_THRESHOLD) -> MoodResult:
+    """Recompute MoodAnalyzer.result() from a feature record."""
+    return MoodAnalyzer.score(columns, positive, negative)
+
+
+SCORERS = {"hand": score_hand, "mood": score_mood}
+
+
+def rescore(path: str, **params):
+    """Load the record at `path` and score it with the given thresholds."""
+    columns, meta = load_features(path)
+    name = meta["name"]
+    accepted = {"hand": ("movement_threshold", "baseline_window"), "mood": ("positive", "negative")}[name]
+    return name, SCORERS[name](columns, meta, **{k: v for k, v in params.items() if k in accepted})
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python features.py path/to/features.npz [...] "
+              "[--movement-threshold=F] [--baseline-window=F] [--positive=F] [--negative=F]")
+        sys.exit(1)
+
+    params = {}
+    paths = []
+    for arg in sys.argv[1:]:
+        if arg.startswith('--'):
+            key, _, value = arg[2:].partition('=')
+            params[key.replace('-', '_')] = float(value)
+        else:
+            paths.append(arg)
+
+    for path in paths:
+        name, result = rescore(path, **params)
+        print(json.dumps({"path": path, name: result.to_dict()}))
@@ -0,0 +1,128 @@
+"""Bounded in-process job queue behind the submit/poll analysis API.
+
+A request is submitted as a job and the caller gets a job id back at once.
+A fixed number of runner threads take jobs from a bounded queue, and callers
+poll for progress and the final result. When the queue is full, submit
+raises QueueFull instead of accepting more work. This stands in for a real
+broker: jobs live in this process's memory and are lost on restart.
+"""
+import os
+import threading
+import time
+import uuid
+from queue import Queue, Full
+
+
+# Jobs run at the same time; the heavy lifting happens in engine.py's pool.
+CONCURRENCY = int(os.environ.get("ANALYSIS_JOB_CONCURRENCY", "2"))
+
+# Jobs allowed to wait for a runner before submit is refused.
+QUEUE_SIZE = int(os.environ.get("ANALYSIS_JOB_QUEUE_SIZE", "16"))
+
+# Finished jobs are kept this many seconds for callers to collect.
+RESULT_TTL = float(os.environ.get("ANALYSIS_JOB_RESULT_TTL", "3600"))
+
+
+class QueueFull(Exception):
+    """Raised by JobQueue.submit when no more work can be accepted."""
+
+
+class Job:
+    """One submitted request and everything a poller may ask about it."""
+
+    def __init__(self, fn, args):
+        self.id = uuid.uuid4().hex
+        self.fn = fn
+        self.args = args
+        self.status = "queued"
+        self.stage = None
+        self.result = None
+        self.error = None
+        self.submitted_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+
+    @property
+    def finished(self):
+        return self.status in ("done", "failed")
+
+    def to_dict(self):
+        data = {
+            "jobId": self.id,
+            "status": self.status,
+            "stage": self.stage,
+            "submittedAt": self.submitted_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+        }
+        if self.status == "done":
+            data["result"] = self.result
+        if self.status == "failed":
+            data["error"] = self.error
+        return data
+
+
+class JobQueue:
+    """Runs submitted jobs on `concurrency` threads from a bounded queue.
+
+    The job function is called as `fn(*args, progress=callback)`; calling
+    `callback(stage)` updates the stage reported to pollers.
+    """
+
+    def __init__(self, concurrency=CONCURRENCY, queue_size=QUEUE_SIZE, result_ttl=RESULT_TTL):
+        self.result_ttl = result_ttl
+        self._queue = Queue(maxsize=queue_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._runners = [threading.Thread(target=self._run, daemon=True) for _ in range(concurrency)]
+        for runner in self._runners:
+            runner.start()
+
+    def submit(self, fn, *args):
+        """Queue `fn(*args)` and return its Job. Raises QueueFull when full."""
+        job = Job(fn, args)
+        with self._lock:
+            self._expire()
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait(job)
+        except Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull("Analysis queue is full")
+        return job
+
+    def get(self, job_id):
+        """Return the Job with `job_id`, or None if unknown or expired."""
+        with self._lock:
+            self._expire()
+            return self._jobs.get(job_id)
+
+    def _expire(self):
+        cutoff = time.time() - self.result_ttl
+        expired = [job_id for job_id, job in self._jobs.items()
+                   if job.finished and job.finished_at < cutoff]
+        for job_id in expired:
+            del self._jobs[job_id]
+
+    def _run(self):
+        while True:
+            job = self._queue.get()
+            # Timestamps are set before the status that reports them, so a
+            # poller or _expire() never sees a finished job without one.
+            job.started_at = time.time()
+            job.status = "running"
+
+            def progress(stage, job=job):
+                job.stage = stage
+
+            try:
+                job.result = job.fn(*job.args, progress=progress)
+                status = "done"
+            except Exception as e:
+                job.error = str(e)
+                status = "failed"
+            # Release the request payload; the result is all pollers need.
+            job.fn = job.args = None
+            job.finished_at = time.time()
+            job.status = status
@@ -0,0 +1,305 @@
+"""Helpers for fetching uploads and inspecting their containers."""
+import json
+import os
+import shutil
+import ssl
+import subprocess
+import urllib.request
+
+
+FFMPEG_PATHS = ['ffmpeg', '/usr/bin/ffmpeg', '/usr/local/bin/ffmpeg']
+FFPROBE_PATHS = ['ffprobe', '/usr/bin/ffprobe', '/usr/local/bin/ffprobe']
+PROBE_TIMEOUT = 30
+
+# Enough of the file to see the MP4 box layout or the EBML header.
+SNIFF_BYTES = 64 * 1024
+
+# Containers ffmpeg can decode front to back without seeking.
+STREAMABLE_CONTAINERS = {"mp4-faststart", "webm", "matroska"}
+
+# Video codecs the FFmpeg build bundled with OpenCV decodes directly.
+OPENCV_VIDEO_CODECS = {"h264", "hevc", "vp8", "vp9", "av1", "mpeg4"}
+AUDIO_CODECS = {"opus", "vorbis", "aac"}
+
+# Matroska/WebM CodecID strings and MP4 sample entry types, as they appear
+# in the track headers.
+_EBML_CODEC_IDS = {
+    b'V_VP8': "vp8",
+    b'V_VP9': "vp9",
+    b'V_AV1': "av1",
+    b'V_MPEG4/ISO/AVC': "h264",
+    b'V_MPEGH/ISO/HEVC': "hevc",
+    b'A_OPUS': "opus",
+    b'A_VORBIS': "vorbis",
+    b'A_AAC': "aac",
+}
+_MP4_SAMPLE_ENTRIES = {
+    b'avc1': "h264",
+    b'avc3': "h264",
+    b'hvc1': "hevc",
+    b'hev1': "hevc",
+    b'vp08': "vp8",
+    b'vp09': "vp9",
+    b'av01': "av1",
+    b'mp4v': "mpeg4",
+    b'mp4a': "aac",
+    b'Opus': "opus",
+}
+
+# Width used when a full transcode cannot be avoided; the analyzers work at
+# PROCESS_WIDTH anyway, so there is no point encoding full resolution.
+FAST_TRANSCODE_WIDTH = 480
+FFMPEG_TIMEOUT = 300
+
+# Mono rate the audio analysis works at; plenty for speech.
+AUDIO_SAMPLE_RATE = 16000
+
+# Frame-source backends for video analysis: "opencv" decodes full frames
+# with cv2.VideoCapture and resizes in Python; "ffmpeg" has ffmpeg scale and
+# decimate while decoding and reads raw frames from a pipe. Requests can
+# pick one; ANALYSIS_DECODER sets the default.
+DECODERS = ("opencv", "ffmpeg")
+DEFAULT_DECODER = os.environ.get("ANALYSIS_DECODER", "opencv")
+
+
+def find_ffmpeg() -> str:
+    """Return the first ffmpeg executable found in the common locations."""
+    for path in FFMPEG_PATHS:
+        if shutil.which(path):
+            return path
+    raise RuntimeError("ffmpeg not found")
+
+
+def find_ffprobe() -> str:
+    """Return the first ffprobe executable found in the common locations."""
+    for path in FFPROBE_PATHS:
+        if shutil.which(path):
+            return path
+    raise RuntimeError("ffprobe not found")
+
+
+def probe_video(src: str, data: bytes = None):
+    """Return (width, height, fps) of the first video stream of `src`, or None.
+
+    With `data`, ffprobe reads those bytes (e.g. the head of a download)
+    from stdin instead. Width and height are as displayed, swapped for
+    rotated video since ffmpeg rotates while decoding; fps is 0.0 when the
+    container does not give one.
+    """
+    cmd = [find_ffprobe(), '-v', 'error', '-select_streams', 'v:0', '-show_streams', '-of', 'json',
+           'pipe:0' if data is not None else src]
+    try:
+        result = subprocess.run(cmd, input=data, capture_output=True, timeout=PROBE_TIMEOUT)
+        streams = json.loads(result.stdout or b'{}').get('streams') or []
+    except (subprocess.TimeoutExpired, ValueError):
+        return None
+    if not streams or not streams[0].get('width') or not streams[0].get('height'):
+        return None
+    stream = streams[0]
+    width, height = int(stream['width']), int(stream['height'])
+    # Older ffprobe reports rotation as a tag, newer as display matrix side data.
+    rotation = stream.get('tags', {}).get('rotate', 0)
+    for side_data in stream.get('side_data_list', []):
+        rotation = side_data.get('rotation', rotation)
+    if int(float(rotation)) % 180:
+        width, height = height, width
+    fps = 0.0
+    for key in ('avg_frame_rate', 'r_frame_rate'):
+        num, _, den = stream.get(key, '0/0').partition('/')
+        try:
+            fps = float(num) / float(den or 1)
+        except (ValueError, ZeroDivisionError):
+            continue
+        if fps > 0:
+            break
+    return width, height, fps
+
+
+def open_url(url: str):
+    """Open `url` for reading, raising if the server does not answer 200."""
+    context = ssl._create_unverified_context()
+    response = urllib.request.urlopen(url, context=context)
+    if response.status != 200:
+        response.close()
+        raise Exception(f"Failed to download file: {response.status}")
+    return response
+
+
+def read_head(fileobj, size: int = SNIFF_BYTES) -> bytes:
+    """Read up to `size` bytes, tolerating short reads from a socket."""
+    chunks = []
+    remaining = size
+    while remaining > 0:
+        chunk = fileobj.read(remaining)
+        if not chunk:
+            break
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def _mp4_layout(head: bytes) -> str:
+    # Walk the top-level boxes: if the index (moov) comes before the media
+    # data (mdat) the file can be decoded as it arrives.
+    offset = 0
+    while offset + 8 <= len(head):
+        size = int.from_bytes(head[offset:offset + 4], 'big')
+        box = head[offset + 4:offset + 8]
+        if box == b'moov':
+            return "mp4-faststart"
+        if box == b'mdat':
+            return "mp4"
+        if size == 1:
+            if offset + 16 > len(head):
+                break
+            size = int.from_bytes(head[offset + 8:offset + 16], 'big')
+        if size < 8:
+            break
+        offset += size
+    return "mp4"
+
+
+def sniff_container(head: bytes):
+    """Identify the container from its leading bytes, or return None."""
+    if head[4:8] == b'ftyp':
+        return _mp4_layout(head)
+    if head[:4] == b'\x1a\x45\xdf\xa3':
+        return "webm" if b'webm' in head[:64] else "matroska"
+    return None
+
+
+def is_streamable(container) -> bool:
+    return container in STREAMABLE_CONTAINERS
+
+
+def sniff_codecs(data: bytes, container) -> set:
+    """Return the codec names whose track tags appear in `data`."""
+    if container in ("webm", "matroska"):
+        table = _EBML_CODEC_IDS
+    elif container and container.startswith("mp4"):
+        table = _MP4_SAMPLE_ENTRIES
+    else:
+        return set()
+    return {name for tag, name in table.items() if tag in data}
+
+
+def probe_file(path: str):
+    """Return (container, codecs) for a local file from its magic bytes.
+
+    The tail is read as well so MP4s with the index at the end still report
+    their codecs.
+    """
+    with open(path, 'rb') as f:
+        head = f.read(SNIFF_BYTES)
+        size = os.fstat(f.fileno()).st_size
+        f.seek(max(size - SNIFF_BYTES, len(head)))
+        tail = f.read()
+    container = sniff_container(head)
+    return container, sniff_codecs(head + tail, container)
+
+
+def opencv_can_decode(path: str) -> bool:
+    """Whether OpenCV's bundled FFmpeg should read `path` as it is.
+
+    Decided with ffprobe rather than by opening the file with OpenCV, so the
+    API process never has to import cv2: the sniffed video codec must be one
+    OpenCV decodes, and ffprobe must find a video stream it can parse.
+    """
+    _, codecs = probe_file(path)
+    video_codecs = codecs - AUDIO_CODECS
+    if video_codecs and not video_codecs & OPENCV_VIDEO_CODECS:
+        return False
+    return probe_video(path) is not None
+
+
+def _run_ffmpeg(args: list) -> None:
+    cmd = [find_ffmpeg(), '-hide_banner', '-loglevel', 'error'] + args
+    try:
+        result = subprocess.run(cmd, capture_output=True, text=True, timeout=FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise Exception("FFmpeg conversion timed out")
+    if result.returncode != 0:
+        raise Exception(f"FFmpeg conversion failed: {result.stderr}")
+
+
+def remux(input_path: str, output_path: str) -> None:
+    """Rewrite the container without touching the encoded streams."""
+    _run_ffmpeg(['-i', input_path, '-c', 'copy', '-y', output_path])
+
+
+def transcode_fast(input_path: str, output_path: str, width: int = FAST_TRANSCODE_WIDTH) -> None:
+    """Low-resolution ultrafast H.264 transcode, for codecs OpenCV cannot read.
+
+    Audio is dropped: the copy only feeds frame decoding, and the audio
+    analysis reads the original file.
+    """
+    _run_ffmpeg([
+        '-i', input_path,
+        '-vf', f'scale=\'min({width},iw)\':-2',
+        '-c:v', 'libx264', '-preset', 'ultrafast', '-crf', '28',
+        '-an',
+        '-y', output_path
+    ])
+
+
+def prepare_for_decode(path: str) -> str:
+    """Return a path OpenCV can decode, converting `path` only if it must.
+
+    The real container and codecs come from the file's magic bytes, not the
+    URL. Files with a codec OpenCV decodes, in a container ffprobe can
+    parse, are used as-is (browser WebM with VP8/VP9 and Opus included);
+    otherwise a stream-copy remux is tried, and a fast
+    low-resolution transcode is the last resort. Any new file is written
+    next to `path` and is the caller's to delete.
+    """
+    container, codecs = probe_file(path)
+    video_codecs = codecs - AUDIO_CODECS
+    decodable = not video_codecs or bool(video_codecs & OPENCV_VIDEO_CODECS)
+
+    if decodable and probe_video(path) is not None:
+        return path
+
+    base = os.path.splitext(path)[0]
+    if decodable and container is not None:
+        remuxed = base + '.remux.mkv'
+        try:
+            remux(path, remuxed)
+            if opencv_can_decode(remuxed):
+                return remuxed
+        except Exception:
+            pass
+        if os.path.exists(remuxed):
+            os.unlink(remuxed)
+
+    transcoded = base + '.fast.mp4'
+    transcode_fast(path, transcoded)
+    return transcoded
+
+
+def decode_audio(path: str, sample_rate: int = AUDIO_SAMPLE_RATE):
+    """Decode the first audio track of `path` to a mono float32 array.
+
+    ffmpeg resamples and writes raw samples to a pipe, so no intermediate
+    file is written. Raises ValueError if the file has no audio track.
+    """
+    import numpy as np
+
+    cmd = [
+        find_ffmpeg(), '-hide_banner', '-loglevel', 'error',
+        '-i', path,
+        '-map', '0:a:0',
+        '-ac', '1',
+        '-ar', str(sample_rate),
+        '-f', 'f32le',
+        'pipe:1'
+    ]
+    try:
+        result = subprocess.run(cmd, capture_output=True, timeout=FFMPEG_TIMEOUT)
+    except subprocess.TimeoutExpired:
+        raise Exception("FFmpeg audio decode timed out")
+    if result.returncode != 0:
+        stderr = result.stderr.decode('utf-8', 'replace')
+        if 'matches no streams' in stderr:
+            raise ValueError("No audio track found in the video file")
+        raise Exception(f"FFmpeg audio decode failed: {stderr}")
+    return np.frombuffer(result.stdout, dtype=np.float32)
@@ -0,0 +1,176 @@
+"""Per-request stage timings and process-wide metrics.
+
+A Trace collects, for each named stage of one request, the wall time, CPU
+time of the threads doing the work, call and frame counts, the deepest
+queue seen and the process's peak RSS. Traces are plain dicts on the wire,
+so worker processes return theirs and the caller merges them in. Finished
+traces feed a registry rendered in the Prometheus text format, and one
+structured log line per request.
+"""
+import importlib
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+LOG_ENABLED = os.environ.get("ANALYSIS_METRICS_LOG", "1") == "1"
+
+logger = logging.getLogger("analysis.metrics")
+if LOG_ENABLED and not logger.handlers:
+    # stdout carries JSON responses in CLI use, so log lines go to stderr.
+    _handler = logging.StreamHandler(sys.stderr)
+    _handler.setFormatter(logging.Formatter("%(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+
+
+def peak_rss() -> int:
+    """Peak resident set size of this process in bytes, or 0 if unknown."""
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes.
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def child_cpu() -> float:
+    """User plus system CPU seconds of this process's finished children."""
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+class Trace:
+    """Stage measurements for one request; safe to share between threads."""
+
+    def __init__(self):
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, wall=0.0, cpu=0.0, calls=1, frames=0, queue_depth=0, **counters):
+        """Accumulate one measurement into stage `name`."""
+        rss = peak_rss()
+        with self._lock:
+            stage = self.stages.setdefault(name, {
+                "wall": 0.0, "cpu": 0.0, "calls": 0, "frames": 0, "queue_depth": 0, "peak_rss": 0,
+            })
+            stage["wall"] += wall
+            stage["cpu"] += cpu
+            stage["calls"] += calls
+            stage["frames"] += frames
+            stage["queue_depth"] = max(stage["queue_depth"], queue_depth)
+            stage["peak_rss"] = max(stage["peak_rss"], rss)
+            for key, value in counters.items():
+                stage[key] = stage.get(key, 0) + value
+
+    @contextmanager
+    def stage(self, name, **counters):
+        """Time the body as one call of stage `name` on the current thread.
+
+        Yields the `counters` dict so the body can fill in counts (frames,
+        bytes) that are only known once the work is done.
+        """
+        wall, cpu = time.perf_counter(), time.thread_time()
+        try:
+            yield counters
+        finally:
+            self.add(name, time.perf_counter() - wall, time.thread_time() - cpu, **counters)
+
+    def merge(self, stages):
+        """Fold in stages recorded elsewhere, e.g. returned by a worker."""
+        for name, stage in stages.items():
+            stage = dict(stage)
+            peak = stage.pop("peak_rss", 0)
+            self.add(name, **stage)
+            with self._lock:
+                self.stages[name]["peak_rss"] = max(self.stages[name]["peak_rss"], peak)
+
+    def to_dict(self):
+        with self._lock:
+            return {name: dict(stage) for name, stage in self.stages.items()}
+
+
+class Registry:
+    """Process-wide totals over finished requests, in Prometheus text format."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stages = {}
+        self._requests = {}
+        self._imports = {}
+
+    def observe(self, trace, status="ok", **fields):
+        stages = trace.to_dict()
+        with self._lock:
+            self._requests[status] = self._requests.get(status, 0) + 1
+            for name, stage in stages.items():
+                total = self._stages.setdefault(name, {"wall": 0.0, "cpu": 0.0, "calls": 0, "frames": 0})
+                for key in total:
+                    total[key] += stage.get(key, 0)
+        if LOG_ENABLED:
+            logger.info(json.dumps(dict(fields, event="analysis", status=status, stages=stages)))
+
+    def record_import(self, module, seconds):
+        """Note how long loading `module` took; startup itself is "startup"."""
+        with self._lock:
+            self._imports[module] = seconds
+        if LOG_ENABLED:
+            logger.info(json.dumps({"event": "import", "module": module, "seconds": seconds}))
+
+    def render(self):
+        lines = [
+            "# HELP analysis_requests_total Analysis requests by outcome.",
+            "# TYPE analysis_requests_total counter",
+        ]
+        with self._lock:
+            for status, count in sorted(self._requests.items()):
+                lines.append(f'analysis_requests_total{{status="{status}"}} {count}')
+            for metric, key, help_text in (
+                    ("analysis_stage_seconds_total", "wall", "Wall time spent in each stage."),
+                    ("analysis_stage_cpu_seconds_total", "cpu", "CPU time spent in each stage."),
+                    ("analysis_stage_calls_total", "calls", "Times each stage ran."),
+                    ("analysis_stage_frames_total", "frames", "Frames handled by each stage.")):
+                lines.append(f"# HELP {metric} {help_text}")
+                lines.append(f"# TYPE {metric} counter")
+                for name, total in sorted(self._stages.items()):
+                    lines.append(f'{metric}{{stage="{name}"}} {total[key]}')
+            lines += [
+                "# HELP analysis_import_seconds Time spent loading the API and each lazily imported module.",
+                "# TYPE analysis_import_seconds gauge",
+            ]
+            for module, seconds in sorted(self._imports.items()):
+                lines.append(f'analysis_import_seconds{{module="{module}"}} {seconds}')
+        lines += [
+            "# HELP process_peak_rss_bytes Peak resident set size of the API process.",
+            "# TYPE process_peak_rss_bytes gauge",
+            f"process_peak_rss_bytes {peak_rss()}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def load(module: str):
+    """Import `module` on first use, recording in REGISTRY how long it took.
+
+    The heavy modules (the analyzers, cv2) are loaded through here wherever
+    they are first needed, so their import cost shows up in the metrics.
+    """
+    if module in sys.modules:
+        return sys.modules[module]
+    started = time.perf_counter()
+    loaded = importlib.import_module(module)
+    REGISTRY.record_import(module, time.perf_counter() - started)
+    return loaded
@@ -0,0 +1,158 @@
+"""Process-level pools of warm MediaPipe graphs.
+
+Building a Hands or FaceMesh graph loads its TFLite models and initializes
+the calculator graph, which costs far more than processing a short clip.
+The pools below keep initialized graphs around so requests only check one
+out, use it for a single video and hand it back.
+"""
+import os
+import threading
+from contextlib import contextmanager
+from queue import Queue, Empty
+
+
+# Maximum number of graphs of each kind kept per process. Requests beyond
+# this wait for a graph to be returned rather than building a new one.
+POOL_SIZE = int(os.environ.get("ANALYSIS_MODEL_POOL_SIZE", "2"))
+
+HAND_MODEL_OPTIONS = {
+    "model_complexity": 0,
+    "max_num_hands": 1,
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.3,
+}
+
+FACE_MESH_OPTIONS = {
+    "max_num_faces": 1,
+    "refine_landmarks": False,
+    "min_detection_confidence": 0.5,
+    "min_tracking_confidence": 0.3,
+}
+
+
+
+def _build_hands():
+    # mediapipe takes seconds to import, so it loads with the first graph
+    # rather than with this module.
+    import mediapipe as mp
+
+    return mp.solutions.hands.Hands(**HAND_MODEL_OPTIONS)
+
+
+def _build_face_mesh():
+    import mediapipe as mp
+
+    return mp.solutions.face_mesh.FaceMesh(**FACE_MESH_OPTIONS)
+
+
+MODEL_FACTORIES = {
+    "hands": _build_hands,
+    "face_mesh": _build_face_mesh,
+}
+
+
+class ModelPool:
+    """A bounded pool of reusable MediaPipe solution instances."""
+
+    def __init__(self, factory, size=None):
+        self.factory = factory
+        # Read at construction, so configure() also applies to pools built later.
+        self.size = POOL_SIZE if size is None else size
+        self._idle = Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def warm(self, count=None):
+        """Build up to `count` graphs ahead of time (default: fill the pool)."""
+        count = self.size if count is None else min(count, self.size)
+        while True:
+            with self._lock:
+                if self._created >= count:
+                    return
+                self._created += 1
+            self._idle.put(self._build())
+
+    def _build(self):
+        try:
+            return self.factory()
+        except Exception:
+            with self._lock:
+                self._created -= 1
+            raise
+
+    def acquire(self, timeout=None):
+        try:
+            return self._idle.get_nowait()
+        except Empty:
+            pass
+        with self._lock:
+            grow = self._created < self.size
+            if grow:
+                self._created += 1
+        if grow:
+            return self._build()
+        return self._idle.get(timeout=timeout)
+
+    def release(self, model):
+        """Return a model to the pool with its tracking state cleared."""
+        try:
+            # Drops landmarks carried over from the previous video so the
+            # next one starts from a fresh detection.
+            model.reset()
+        except Exception:
+            self.discard(model)
+            return
+        self._idle.put(model)
+
+    def discard(self, model):
+        """Drop a model that can no longer be trusted; a new one is built on demand."""
+        try:
+            model.close()
+        except Exception:
+            pass
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def checkout(self, timeout=None):
+        model = self.acquire(timeout)
+        try:
+            yield model
+        finally:
+            self.release(model)
+
+    def close(self):
+        while True:
+            try:
+                model = self._idle.get_nowait()
+            except Empty:
+                return
+            self.discard(model)
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(kind):
+    """Return the process-wide pool for `kind` ("hands" or "face_mesh")."""
+    with _pools_lock:
+        pool = _pools.get(kind)
+        if pool is None:
+            pool = _pools[kind] = ModelPool(MODEL_FACTORIES[kind])
+        return pool
+
+
+def configure(size):
+    """Change the pool size for every kind of model in this process."""
+    global POOL_SIZE
+    POOL_SIZE = size
+    with _pools_lock:
+        for pool in _pools.values():
+            pool.size = size
+
+
+def warm_up(kinds=tuple(MODEL_FACTORIES)):
+    """Pre-build graphs so the first requests do not pay for initialization."""
+    for kind in kinds:
+        get_pool(kind).warm()
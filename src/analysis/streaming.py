@@ -0,0 +1,253 @@
+"""Analyze remote videos while they are still downloading.
+
+The download is teed into a local file and into an ffmpeg process that
+decodes from its stdin, so frames reach the analyzers as soon as the bytes
+arrive and network time overlaps with compute time. Containers that need
+random access (MP4 with the index at the end) fall back to a full download.
+"""
+import shutil
+import subprocess
+import threading
+import time
+from collections import deque
+from queue import Queue, Empty
+
+from config import PROCESS_WIDTH, DEFAULT_SAMPLE_RATES
+from media import find_ffmpeg, probe_video, open_url, read_head, sniff_container, is_streamable
+from metrics import Trace
+from video import Frame, FramePool, FRAME_POOL_SIZE, analyze
+
+
+CHUNK_SIZE = 256 * 1024
+
+# Assumed source frame rate when ffprobe does not report a usable one. WebM
+# from MediaRecorder often reports its 1 kHz timebase instead, hence the cap.
+DEFAULT_SOURCE_FPS = 30.0
+MAX_SOURCE_FPS = 240.0
+
+# ffmpeg's stderr is only kept for diagnosing failures.
+STDERR_LINES = 50
+
+
+class PipeVideoStream:
+    """VideoStream counterpart that decodes with an ffmpeg process.
+
+    ffmpeg does the fps decimation, resize and pixel format conversion, so
+    only sampled frames ever reach Python, already small and BGR. Raw frames
+    are read from the pipe straight into the slots of a FramePool. By default
+    the input is the bytes passed to feed(), and `head`, the first of those
+    bytes, is needed to size the frames; with `src` ffmpeg reads that file
+    itself (the "ffmpeg" decoder backend in video.py). Raises IOError if
+    ffprobe finds no video stream.
+
+    With a `sample_rate`, frame timestamps come from the output frame rate
+    and frame indices are mapped back onto the source frame rate; without
+    one every frame is passed on. ffmpeg scales straight from the source to
+    `process_width`; there is no separate detail copy, so analyzers that
+    crop (see video.MoodAnalyzer) crop the image itself.
+    """
+
+    def __init__(self, sample_rate, process_width=PROCESS_WIDTH, queue_size=FRAME_POOL_SIZE,
+                 pool_size=FRAME_POOL_SIZE, src='pipe:0', head=None, trace=None):
+        self.trace = trace or Trace()
+        info = probe_video(src, head if src == 'pipe:0' else None)
+        if info is None:
+            raise IOError(f"No video stream found in: {src}")
+        width, height, fps = info
+        # The output size is set outright so the frame shape is known
+        # before ffmpeg starts; the height keeps the aspect, rounded to even.
+        out_height = max(2, round(process_width * height / width / 2) * 2)
+        filters = [f'fps={sample_rate}'] if sample_rate else []
+        filters.append(f'scale={process_width}:{out_height}')
+        cmd = [
+            find_ffmpeg(),
+            '-hide_banner',
+            '-nostats',
+            '-loglevel', 'error',
+            '-i', src,
+            '-an',
+            '-vf', ','.join(filters),
+            '-f', 'rawvideo',
+            '-pix_fmt', 'bgr24',
+            'pipe:1'
+        ]
+        self.sample_rate = sample_rate
+        self.process_width = process_width
+        self.shape = (out_height, process_width, 3)
+        self.source_fps = fps if 0 < fps <= MAX_SOURCE_FPS else DEFAULT_SOURCE_FPS
+        stdin = subprocess.PIPE if src == 'pipe:0' else subprocess.DEVNULL
+        self.proc = subprocess.Popen(cmd, stdin=stdin, stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE, bufsize=0)
+        self.stderr_lines = deque(maxlen=STDERR_LINES)
+        self.pool = FramePool(pool_size)
+        self.stopped = False
+        self.frame_count = 0
+        self.Q = Queue(maxsize=queue_size)
+        self.t = threading.Thread(target=self.update, daemon=True)
+        self._stderr_thread = threading.Thread(target=self._read_stderr, daemon=True)
+
+    def start(self):
+        self._stderr_thread.start()
+        self.t.start()
+        return self
+
+    def feed(self, data):
+        """Pass downloaded bytes to the decoder; False once it stopped reading."""
+        try:
+            self.proc.stdin.write(data)
+            return True
+        except (BrokenPipeError, OSError, ValueError):
+            return False
+
+    def close_input(self):
+        try:
+            self.proc.stdin.close()
+        except (AttributeError, OSError):
+            pass
+
+    def _read_stderr(self):
+        # Drained so ffmpeg never blocks on a full pipe.
+        for raw in iter(self.proc.stderr.readline, b''):
+            self.stderr_lines.append(raw.decode('utf-8', 'replace').rstrip())
+
+    def _read_frame(self, buffers, name):
+        frame = buffers.array(name, self.shape)
+        view = memoryview(frame).cast('B')
+        filled = 0
+        while filled < len(view):
+            n = self.proc.stdout.readinto(view[filled:])
+            if not n:
+                return None
+            filled += n
+        return frame
+
+    def _acquire(self):
+        while not self.stopped:
+            try:
+                return self.pool.acquire(timeout=0.05)
+            except Empty:
+                continue
+        return None
+
+    def update(self):
+        # Decoding happens in ffmpeg, so only the wait for each frame is
+        # measured here; it includes time spent waiting on the network.
+        wait = 0.0
+        depth = 0
+        while not self.stopped:
+            buffers = self._acquire()
+            if buffers is None:
+                break
+            started = time.perf_counter()
+            image = self._read_frame(buffers, "image")
+            wait += time.perf_counter() - started
+            if image is None:
+                self.pool.release(buffers)
+                break
+            if self.sample_rate:
+                timestamp = self.frame_count / self.sample_rate
+                index = int(round(timestamp * self.source_fps))
+            else:
+                index = self.frame_count
+                timestamp = index / self.source_fps
+            depth = max(depth, self.Q.qsize())
+            self.Q.put(Frame(image, index, timestamp, buffers=buffers, pool=self.pool))
+            self.frame_count += 1
+        self.stopped = True
+        self.trace.add("decode", wait, calls=self.frame_count, frames=self.frame_count, queue_depth=depth)
+        self.Q.put(None)
+
+    def read(self):
+        return self.Q.get()
+
+    def __iter__(self):
+        while True:
+            frame = self.read()
+            if frame is None:
+                return
+            yield frame
+
+    def stop(self):
+        self.stopped = True
+        if self.proc.poll() is None:
+            self.proc.kill()
+        while self.t.is_alive():
+            while not self.Q.empty():
+                frame = self.Q.get_nowait()
+                if frame is not None:
+                    frame.release()
+            self.t.join(timeout=0.05)
+        self.proc.wait()
+
+    @property
+    def failed(self):
+        return self.frame_count == 0 and self.proc.poll() not in (None, 0)
+
+
+def _tee_download(head, response, dest_path, stream, errors, trace):
+    started = time.perf_counter()
+    received = len(head)
+    try:
+        with open(dest_path, 'wb') as out:
+            feeding = stream.feed(head)
+            out.write(head)
+            while True:
+                chunk = response.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                received += len(chunk)
+                out.write(chunk)
+                if feeding:
+                    feeding = stream.feed(chunk)
+    except Exception as e:
+        errors.append(e)
+    finally:
+        stream.close_input()
+        trace.add("download", time.perf_counter() - started, bytes=received)
+
+
+def analyze_url(url, dest_path, modes=("mood", "hand"), sample_rates=None, trace=None):
+    """Download `url` to `dest_path` while analyzing it; returns {name: result}.
+
+    Streaming needs time-based sampling, so `sample_rates` defaults to
+    DEFAULT_SAMPLE_RATES. The complete download is left at `dest_path`.
+    Downloads that cannot be streamed are analyzed from the file on the
+    "ffmpeg" decoder, so every path gives the results a file analysis with
+    that decoder and those rates would, and can share its cache entries.
+    """
+    sample_rates = sample_rates or DEFAULT_SAMPLE_RATES
+    trace = trace or Trace()
+    with open_url(url) as response:
+        head = read_head(response)
+        stream = None
+        if is_streamable(sniff_container(head)):
+            rate = max(sample_rates.get(mode, 0.0) for mode in modes) or max(DEFAULT_SAMPLE_RATES.values())
+            try:
+                stream = PipeVideoStream(rate, head=head, trace=trace).start()
+            except IOError:
+                # ffprobe could not find the video stream in the head.
+                stream = None
+        if stream is None:
+            with trace.stage("download"):
+                with open(dest_path, 'wb') as out:
+                    out.write(head)
+                    shutil.copyfileobj(response, out)
+            return analyze(dest_path, modes=modes, sample_rates=sample_rates, decoder="ffmpeg", trace=trace)
+
+        errors = []
+        feeder = threading.Thread(target=_tee_download, args=(head, response, dest_path, stream, errors, trace),
+                                  daemon=True)
+        feeder.start()
+        try:
+            results = analyze(dest_path, modes=modes, sample_rates=sample_rates, stream=stream, trace=trace)
+        finally:
+            # Stop the decoder first so a blocked feed() cannot hold up the download.
+            stream.stop()
+            feeder.join()
+
+    if errors:
+        raise errors[0]
+    if stream.failed:
+        # The container turned out not to be decodable from a pipe.
+        return analyze(dest_path, modes=modes, sample_rates=sample_rates, decoder="ffmpeg", trace=trace)
+    return results
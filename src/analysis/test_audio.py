@@ -0,0 +1,39 @@
+"""Chunked spectral extraction against the single pass it replaces."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+pytest.importorskip("parselmouth")
+
+import audio
+
+
+SAMPLE_RATE = 16000
+
+
+def synthetic_speech(seconds=7.0, sr=SAMPLE_RATE):
+    # A gliding tone over steady noise: every chunk has the same loudness,
+    # so power_to_db's floor sits at the same level in each piece.
+    rng = np.random.default_rng(0)
+    t = np.arange(int(seconds * sr)) / sr
+    tone = 0.5 * np.sin(2 * np.pi * (150 + 40 * np.sin(2 * np.pi * 0.5 * t)) * t)
+    return (tone + 0.05 * rng.standard_normal(t.size)).astype(np.float32)
+
+
+def test_chunked_matches_single_pass(monkeypatch):
+    y = synthetic_speech()
+    # Pieces of two seconds cut the signal several times, mid-frame included.
+    monkeypatch.setattr(audio, "CHUNK_SECONDS", 2.0)
+
+    single = audio.extract_spectral_features(y, SAMPLE_RATE)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        chunked = audio.extract_spectral_features_chunked(y, SAMPLE_RATE, executor)
+
+    for name in ("rms", "spectral_centroid", "spectral_rolloff", "zero_crossing_rate"):
+        assert chunked[name].shape == single[name].shape, name
+        np.testing.assert_allclose(chunked[name], single[name], rtol=1e-4, atol=1e-6, err_msg=name)
+    assert chunked["mfccs"].shape == single["mfccs"].shape
+    np.testing.assert_allclose(chunked["mfccs"], single["mfccs"], rtol=1e-3, atol=1e-2)
+    np.testing.assert_allclose(chunked["onset_envelope"], single["onset_envelope"], rtol=1e-3, atol=1e-3)
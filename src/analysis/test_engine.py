@@ -0,0 +1,29 @@
+"""Worker initialization in the process-pool engine."""
+import engine
+import models
+
+
+def test_worker_builds_one_graph_of_each_kind(monkeypatch):
+    built = {kind: 0 for kind in models.MODEL_FACTORIES}
+
+    class FakeGraph:
+        def reset(self):
+            pass
+
+        def close(self):
+            pass
+
+    def factory(kind):
+        def build():
+            built[kind] += 1
+            return FakeGraph()
+        return build
+
+    monkeypatch.setattr(models, "_pools", {})
+    monkeypatch.setattr(models, "POOL_SIZE", 2)
+    monkeypatch.setattr(models, "MODEL_FACTORIES", {kind: factory(kind) for kind in built})
+    # warm_up()'s default kinds were taken from the real factories at import.
+    monkeypatch.setattr(models.warm_up, "__defaults__", (tuple(built),))
+    engine._init_worker()
+    assert built == {kind: 1 for kind in built}
+    assert all(models.get_pool(kind).size == 1 for kind in built)
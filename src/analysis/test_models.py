@@ -0,0 +1,35 @@
+"""Model pool sizing, with stand-in factories instead of MediaPipe graphs."""
+import models
+
+
+class FakeGraph:
+    def reset(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def test_configure_before_first_use_sizes_new_pools(monkeypatch):
+    monkeypatch.setattr(models, "_pools", {})
+    monkeypatch.setattr(models, "POOL_SIZE", models.POOL_SIZE)
+    models.configure(1)
+    assert models.get_pool("hands").size == 1
+    assert models.get_pool("face_mesh").size == 1
+
+
+def test_warm_up_builds_one_graph_per_kind_after_configure(monkeypatch):
+    built = {kind: 0 for kind in models.MODEL_FACTORIES}
+
+    def factory(kind):
+        def build():
+            built[kind] += 1
+            return FakeGraph()
+        return build
+
+    monkeypatch.setattr(models, "_pools", {})
+    monkeypatch.setattr(models, "POOL_SIZE", 2)
+    monkeypatch.setattr(models, "MODEL_FACTORIES", {kind: factory(kind) for kind in built})
+    models.configure(1)
+    models.warm_up(tuple(built))
+    assert built == {kind: 1 for kind in built}
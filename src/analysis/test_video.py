@@ -0,0 +1,42 @@
+"""MotionGate decisions on synthetic frames."""
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("cv2")
+
+from video import Frame, MotionGate
+
+
+def frame(level, timestamp, block=None):
+    # A flat gray frame, optionally with a brighter square in one corner.
+    image = np.full((192, 256, 3), level, dtype=np.uint8)
+    if block is not None:
+        image[:block, :block] = level + 100
+    return Frame(image, 0, timestamp)
+
+
+def decisions(gate, frames):
+    return [gate.changed(f) for f in frames]
+
+
+def test_static_frames_reuse_the_first_inference():
+    gate = MotionGate()
+    assert decisions(gate, [frame(100, t / 10) for t in range(5)]) == [True, False, False, False, False]
+
+
+def test_local_motion_runs_the_model():
+    gate = MotionGate()
+    assert decisions(gate, [frame(100, 0.0), frame(100, 0.1, block=40)]) == [True, True]
+
+
+def test_drift_adds_up_against_the_last_inferred_frame():
+    # Each step is below the pixel delta, but the third is not once summed.
+    gate = MotionGate(pixel_delta=12)
+    steps = [frame(100 + 5 * i, i / 10) for i in range(4)]
+    assert decisions(gate, steps) == [True, False, False, True]
+
+
+def test_max_interval_forces_an_inference():
+    gate = MotionGate(max_interval=2.0)
+    assert decisions(gate, [frame(100, 0.0), frame(100, 1.0), frame(100, 2.5), frame(100, 3.0)]) == [
+        True, False, True, False]
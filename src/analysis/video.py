@@ -1,275 +1,862 @@
 import json
-import mediapipe as mp
+import math
 import numpy as np
 import cv2
 import time
 import threading
-from queue import Queue
+from contextlib import ExitStack
+from queue import Queue, Empty
 import sys
 
+from config import (PROCESS_WIDTH, MOTION_GATE, GATE_THUMB_WIDTH, GATE_PIXEL_DELTA,
+                    GATE_CHANGED_FRACTION, GATE_MAX_INTERVAL, FACE_ROI, ROI_DETAIL_WIDTH, ROI_INPUT_SIZE, ROI_MARGIN,
+                    ROI_MIN_SIZE, HandParams, MoodParams, HandResult, MoodResult)
+from media import DECODERS, DEFAULT_DECODER
+from metrics import Trace
+from models import get_pool
 
-def hand(video_file):
-   VIDEO_FILE = video_file
-   PROCESS_WIDTH = 240
-   CALIBRATION_DURATION = 2.0
-   FRAME_SKIP_RATE = 30
-   MOVEMENT_THRESHOLD = 0.05
-   WRIST_LANDMARK = 0
-
-
-   class VideoStream:
-       def __init__(self, src, queue_size=128):
-           self.stream = cv2.VideoCapture(src)
-           if not self.stream.isOpened():
-               raise IOError
-           self.stopped = False
-           self.Q = Queue(maxsize=queue_size)
-           self.t = threading.Thread(target=self.update, args=())
-           self.t.daemon = True
-
-
-       def start(self):
-           self.t.start()
-           self.Q.join()
-           return self
-
-
-       def update(self):
-           while not self.stopped:
-               success, frame = self.stream.read()
-               if not success:
-                   self.stopped = True
-                   break
-               frame_resized = cv2.resize(frame, (PROCESS_WIDTH, int(frame.shape[0] * PROCESS_WIDTH / frame.shape[1])))
-               self.Q.put(frame_resized)
-               self.Q.task_done()
-           self.stream.release()
 
+ANALYZER_QUEUE_SIZE = 32
 
-       def read(self):
-           return self.Q.get()
+# Frame buffers preallocated per stream. Decoding waits for a free one, so
+# this bounds the frames alive per request (see FramePool).
+FRAME_POOL_SIZE = 48
 
+# A frame this close before a sampling grid point counts as on it. Half a
+# frame at 60 fps: WebM rounds timestamps to the millisecond, which would
+# otherwise push every third sample at 30 fps one frame late.
+SAMPLE_TOLERANCE = 0.5 / 60
 
-       def more(self):
-           return self.Q.qsize() > 0 or not self.stopped
+# Gaps between samples longer than this (in seconds) are crossed with a seek
+# instead of grabbing every frame in between.
+SEEK_GAP = 5.0
 
 
-       def stop(self):
-           self.stopped = True
-           if threading.current_thread() != self.t and self.t.is_alive():
-               self.t.join()
+class FrameBuffers:
+   """One slot of a FramePool: named arrays reused from frame to frame."""
 
+   def __init__(self):
+      self.arrays = {}
 
-   def analyze_hand_position(frame, hands_model):
-       rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-       res = hands_model.process(rgb)
-       wrist_y = None
-       if res.multi_hand_landmarks:
-           hand_landmarks = res.multi_hand_landmarks[0]
-           wrist = hand_landmarks.landmark[WRIST_LANDMARK]
-           wrist_y = wrist.y
-       return wrist_y
 
+   def array(self, name, shape, dtype=np.uint8):
+      """The array kept under `name`, reallocated only if `shape` changed."""
+      array = self.arrays.get(name)
+      if array is None or array.shape != shape or array.dtype != dtype:
+         array = self.arrays[name] = np.empty(shape, dtype)
+      return array
 
-   mp_hands = mp.solutions.hands
 
+def resize_into(frame, width, buffers, name, interpolation=cv2.INTER_LINEAR):
+   """Resize `frame` to `width` (keeping its aspect) into slot array `name`."""
+   height = int(frame.shape[0] * width / frame.shape[1])
+   return cv2.resize(frame, (width, height), dst=buffers.array(name, (height, width) + frame.shape[2:]),
+                     interpolation=interpolation)
 
-   try:
-       vs = VideoStream(VIDEO_FILE).start()
-   except IOError as e:
-       exit()
-
-
-   with mp_hands.Hands(
-           model_complexity=0,
-           max_num_hands=1,
-           min_detection_confidence=0.5,
-           min_tracking_confidence=0.3) as hands:
 
+class FramePool:
+   """A fixed ring of FrameBuffers shared by a reader and its analyzers.
 
-       baseline_samples = []
-       start_time = time.time()
-       calibration_frame_count = 0
+   The reader takes a free slot for each frame it decodes and writes into
+   it in place; the slot comes back once every analyzer has released the
+   frame. When all slots are in use the reader waits, so a stream never
+   holds more than `size` frames, however far the analyzers fall behind.
+   """
 
+   def __init__(self, size=FRAME_POOL_SIZE):
+      self.size = size
+      self._free = Queue()
+      for _ in range(size):
+         self._free.put(FrameBuffers())
 
 
+   def acquire(self, timeout=None):
+      """Return a free slot; raises queue.Empty if none frees up in `timeout`."""
+      return self._free.get(timeout=timeout)
 
-       while time.time() - start_time < CALIBRATION_DURATION and vs.more():
-           frame = vs.read()
-           if calibration_frame_count % FRAME_SKIP_RATE == 0:
-               wrist_y = analyze_hand_position(frame, hands)
-               if wrist_y is not None:
-                   baseline_samples.append(wrist_y)
-           calibration_frame_count += 1
 
+   def release(self, buffers):
+      self._free.put(buffers)
 
-       if not baseline_samples:
-           vs.stop()
-           exit()
 
+class Frame:
+   """A decoded, resized frame shared read-only by every analyzer.
 
-       baseline_y = np.mean(baseline_samples)
-  
+   `detail` is an optional higher-resolution copy for analyzers that crop
+   into the frame; it defaults to `image`. A frame decoded into a FramePool
+   slot goes back to the pool after release() has been called once per
+   holder (see share()); its arrays must not be used after that.
+   """
 
+   def __init__(self, image, index, timestamp=0.0, detail=None, buffers=None, pool=None):
+      self.image = image
+      self.index = index
+      self.timestamp = timestamp
+      self.detail = image if detail is None else detail
+      self._buffers = buffers
+      self._pool = pool
+      self._refs = 1
+      self._rgb = None
+      self._thumbnail = None
+      self._lock = threading.Lock()
 
-       total_frames = 0
-       tracking_frame_count = 0
-       start_tracking = time.time()
-       good_movement_frames = 0
 
+   def _buffer(self, name, shape):
+      # Without a pool slot OpenCV allocates the output as usual.
+      return self._buffers.array(name, shape) if self._buffers is not None else None
 
-       while vs.more():
-           frame = vs.read()
-           total_frames += 1
-           if tracking_frame_count % FRAME_SKIP_RATE == 0:
-               wrist_y = analyze_hand_position(frame, hands)
-               if wrist_y is not None:
-                   diff = wrist_y - baseline_y
-                   if abs(diff) > MOVEMENT_THRESHOLD:
-                       good_movement_frames += 1
-           tracking_frame_count += 1
 
+   @property
+   def rgb(self):
+      # Converted at most once per frame, no matter how many analyzers ask.
+      with self._lock:
+         if self._rgb is None:
+            self._rgb = cv2.cvtColor(self.image, cv2.COLOR_BGR2RGB, dst=self._buffer("rgb", self.image.shape))
+         return self._rgb
 
-       duration = time.time() - start_tracking
-       final_goodness = (good_movement_frames / total_frames) * 100 if total_frames > 0 else 0.0
 
+   @property
+   def thumbnail(self):
+      # Small grayscale copy for the motion gate; area averaging smooths out
+      # sensor noise that would otherwise read as motion.
+      with self._lock:
+         if self._thumbnail is None:
+            gray = cv2.cvtColor(self.image, cv2.COLOR_BGR2GRAY, dst=self._buffer("gray", self.image.shape[:2]))
+            height = max(1, round(gray.shape[0] * GATE_THUMB_WIDTH / gray.shape[1]))
+            self._thumbnail = cv2.resize(gray, (GATE_THUMB_WIDTH, height),
+                                         dst=self._buffer("thumbnail", (height, GATE_THUMB_WIDTH)),
+                                         interpolation=cv2.INTER_AREA)
+         return self._thumbnail
 
 
-
-   vs.stop()
-   result = {"hand": final_goodness}
-   print(json.dumps(result))
-   return result
-
-
-def mood(video_path):
-   VIDEO_FILE = video_path
-   PROCESS_WIDTH = 240
-   FRAME_SKIP_RATE = 10
-
-
-   class VideoStream:
-       def __init__(self, src, queue_size=128):
-           self.stream = cv2.VideoCapture(src)
-           if not self.stream.isOpened():
-               raise IOError
-           self.stopped = False
-           self.Q = Queue(maxsize=queue_size)
-           self.t = threading.Thread(target=self.update, args=())
-           self.t.daemon = True
-
-
-       def start(self):
-           self.t.start()
-           return self
-
-
-       def update(self):
-           while not self.stopped:
-               success, frame = self.stream.read()
-               if not success:
-                   self.stopped = True
-                   break
-               frame = cv2.resize(frame, (PROCESS_WIDTH, int(frame.shape[0] * PROCESS_WIDTH / frame.shape[1])))
-               self.Q.put(frame)
-           self.stream.release()
-          
-       def read(self):
-           return self.Q.get()
-
-
-       def more(self):
-           return self.Q.qsize() > 0 or not self.stopped
-
-
-       def stop(self):
-           self.stopped = True
-           if threading.current_thread() != self.t and self.t.is_alive():
-               self.t.join()
-
-
-   def analyze_mood(frame, face_mesh_model):
-       frame_h, frame_w, _ = frame.shape
-       scale_factor = PROCESS_WIDTH / frame_w
-       small_frame = cv2.resize(frame, (PROCESS_WIDTH, int(frame_h * scale_factor)))
-       rgb = cv2.cvtColor(small_frame, cv2.COLOR_BGR2RGB)
-       res = face_mesh_model.process(rgb)
-       mood_score = None
-       if res.multi_face_landmarks:
-           lm = res.multi_face_landmarks[0].landmark
-           mouth_right = np.array([lm[61].x, lm[61].y])
-           mouth_left = np.array([lm[291].x, lm[291].y])
-           left_eye_inner = np.array([lm[33].x, lm[33].y])
-           right_eye_inner = np.array([lm[263].x, lm[263].y])
-           eye_distance = np.linalg.norm(left_eye_inner - right_eye_inner)
-           mouth_width = np.linalg.norm(mouth_left - mouth_right)
-           if eye_distance > 0:
-               mood_score = mouth_width / eye_distance
-       return mood_score
-
-
-   mp_face_mesh = mp.solutions.face_mesh
-
+   def share(self, holders):
+      """Set how many holders will each call release(); 0 releases it now."""
+      with self._lock:
+         self._refs = holders
+      if holders == 0:
+         self._recycle()
+
+
+   def release(self):
+      with self._lock:
+         self._refs -= 1
+         last = self._refs == 0
+      if last:
+         self._recycle()
+
+
+   def _recycle(self):
+      pool, self._pool = self._pool, None
+      if pool is not None:
+         pool.release(self._buffers)
+
+
+class SampleClock:
+   """Picks the frames that land on a fixed samples-per-second grid.
+
+   Works on media timestamps, so a rate of 2.0 means two samples per second
+   of video whether the upload is 24, 30 or 60 fps (or variable rate).
+   """
+
+   def __init__(self, rate, tolerance=SAMPLE_TOLERANCE):
+      self.interval = 1.0 / rate
+      self.tolerance = tolerance
+      self.next_time = 0.0
+
+
+   def take(self, timestamp):
+      timestamp += self.tolerance
+      if timestamp < self.next_time:
+         return False
+      self.next_time = (math.floor(timestamp / self.interval) + 1) * self.interval
+      return True
+
+
+class FrameStride:
+   """Picks every `stride`-th frame it is shown, starting with the first."""
+
+   def __init__(self, stride):
+      self.stride = stride
+      self.count = 0
+
+
+   def take(self, timestamp):
+      due = self.count % self.stride == 0
+      self.count += 1
+      return due
+
+
+class MotionGate:
+   """Says whether a sampled frame has changed enough to run the model again.
+
+   Frames are compared with the last frame that was inferred, not the last
+   one seen, so slow drift still adds up to a fresh inference.
+   """
+
+   def __init__(self, pixel_delta=GATE_PIXEL_DELTA, changed_fraction=GATE_CHANGED_FRACTION,
+                max_interval=GATE_MAX_INTERVAL):
+      self.pixel_delta = pixel_delta
+      self.changed_fraction = changed_fraction
+      self.max_interval = max_interval
+      self.reference = None
+      self.reference_time = 0.0
+
+
+   def changed(self, frame):
+      thumbnail = frame.thumbnail
+      if (self.reference is not None and self.reference.shape == thumbnail.shape
+            and abs(frame.timestamp - self.reference_time) < self.max_interval):
+         moved = np.count_nonzero(cv2.absdiff(thumbnail, self.reference) > self.pixel_delta)
+         if moved < self.changed_fraction * thumbnail.size:
+            return False
+      # The thumbnail lives in a pooled buffer that will be reused.
+      self.reference = thumbnail.copy()
+      self.reference_time = frame.timestamp
+      return True
+
+
+class VideoStream:
+   """Background reader that decodes and resizes each frame exactly once.
+
+   With `sample_rates` set, frames that no rate needs are only grabbed, never
+   retrieved, so they skip pixel conversion and resizing entirely; gaps longer
+   than `seek_gap` seconds are crossed with a timestamp seek. With
+   `detail_width`, the frames `detail_schedule` takes (a SampleClock or
+   FrameStride shown every retrieved frame; all of them when None) also keep
+   a copy at that width (never wider than the source) as Frame.detail. Both
+   the image and the detail copy are resized from the source frame, so the
+   image does not depend on which analyzers share the decode. Frames are
+   decoded and resized in place into a FramePool of `pool_size` slots;
+   consumers release() each frame.
+   """
+
+   def __init__(self, src, process_width=PROCESS_WIDTH, queue_size=FRAME_POOL_SIZE, sample_rates=None,
+                seek_gap=SEEK_GAP, detail_width=None, detail_schedule=None, pool_size=FRAME_POOL_SIZE, trace=None):
+      self.trace = trace or Trace()
+      self.stream = cv2.VideoCapture(src)
+      if not self.stream.isOpened():
+         raise IOError(f"Could not open video: {src}")
+      self.process_width = process_width
+      self.detail_width = detail_width
+      self.detail_schedule = detail_schedule
+      self.sample_rates = sorted(set(sample_rates or ()))
+      self.seek_gap = seek_gap
+      self.fps = self.stream.get(cv2.CAP_PROP_FPS) or 0.0
+      self.pool = FramePool(pool_size)
+      self._source = None
+      self.stopped = False
+      self.Q = Queue(maxsize=queue_size)
+      self.t = threading.Thread(target=self.update, args=())
+      self.t.daemon = True
+
+
+   def start(self):
+      self.t.start()
+      return self
+
+
+   def _timestamp(self, index):
+      msec = self.stream.get(cv2.CAP_PROP_POS_MSEC)
+      if msec > 0 or index == 0:
+         return msec / 1000.0
+      # Some containers never report a position; fall back to nominal fps.
+      return index / self.fps if self.fps > 0 else 0.0
+
+
+   def _acquire(self):
+      # Wait for the analyzers to hand a slot back, unless stopped meanwhile.
+      while not self.stopped:
+         try:
+            return self.pool.acquire(timeout=0.05)
+         except Empty:
+            continue
+      return None
+
+
+   def _copy(self, frame, buffers, name):
+      copy = buffers.array(name, frame.shape, frame.dtype)
+      np.copyto(copy, frame)
+      return copy
+
+
+   def update(self):
+      clocks = [SampleClock(rate) for rate in self.sample_rates]
+      index = 0
+      wall = cpu = 0.0
+      grabbed = retrieved = depth = 0
+      while not self.stopped:
+         started, started_cpu = time.perf_counter(), time.thread_time()
+         if not self.stream.grab():
+            break
+         grabbed += 1
+         timestamp = self._timestamp(index)
+         due = [clock.take(timestamp) for clock in clocks]
+         if not clocks or any(due):
+            # Time spent waiting for a free slot is the analyzers' time.
+            waited = time.perf_counter()
+            buffers = self._acquire()
+            if buffers is None:
+               break
+            started += time.perf_counter() - waited
+            # Full-size frames are only read once, so the decoder keeps a
+            # single one; retrieve() reuses it while the size matches.
+            success, frame = self.stream.retrieve(self._source)
+            if not success:
+               self.pool.release(buffers)
+               break
+            self._source = frame
+            detail = None
+            if self.detail_width and (self.detail_schedule is None or self.detail_schedule.take(timestamp)):
+               if frame.shape[1] > self.detail_width:
+                  detail = resize_into(frame, self.detail_width, buffers, "detail", cv2.INTER_AREA)
+               else:
+                  detail = self._copy(frame, buffers, "detail")
+            if self.process_width:
+               image = resize_into(frame, self.process_width, buffers, "image")
+            else:
+               image = self._copy(frame, buffers, "image")
+            retrieved += 1
+            depth = max(depth, self.Q.qsize())
+            wall += time.perf_counter() - started
+            cpu += time.thread_time() - started_cpu
+            self.Q.put(Frame(image, index, timestamp, detail, buffers, self.pool))
+         else:
+            wall += time.perf_counter() - started
+            cpu += time.thread_time() - started_cpu
+         index += 1
+         if clocks and self.seek_gap:
+            next_time = min(clock.next_time for clock in clocks)
+            if next_time - timestamp > self.seek_gap:
+               # Land one nominal frame early so the next grab reaches the target.
+               lead = 1.0 / self.fps if self.fps > 0 else 0.0
+               if self.stream.set(cv2.CAP_PROP_POS_MSEC, max(next_time - lead, 0.0) * 1000.0):
+                  index = int(self.stream.get(cv2.CAP_PROP_POS_FRAMES))
+      self.stopped = True
+      self.stream.release()
+      # Time blocked on a full queue is left out; that is the analyzers' time.
+      self.trace.add("decode", wall, cpu, calls=grabbed, frames=retrieved, queue_depth=depth)
+      self.Q.put(None)
+
+
+   def read(self):
+      """Return the next frame, or None once the stream is exhausted."""
+      return self.Q.get()
+
+
+   def __iter__(self):
+      while True:
+         frame = self.read()
+         if frame is None:
+            return
+         yield frame
+
+
+   def stop(self):
+      self.stopped = True
+      if threading.current_thread() != self.t and self.t.is_alive():
+         # Unblock a reader stuck on a full queue before waiting for it.
+         while self.t.is_alive():
+            while not self.Q.empty():
+               frame = self.Q.get_nowait()
+               if frame is not None:
+                  frame.release()
+            self.t.join(timeout=0.05)
+
+
+class SampleBuffer:
+   """Preallocated table of float64 rows, one per sampled frame.
+
+   The inference loops only append raw coordinates here; scores are
+   computed over whole columns once the video is done. Capacity doubles
+   when full, so appends stay amortized O(1) without per-row objects.
+   """
+
+   def __init__(self, columns, capacity=256):
+      self.columns = tuple(columns)
+      self._rows = np.empty((capacity, len(self.columns)), dtype=np.float64)
+      self.size = 0
+
+
+   def __len__(self):
+      return self.size
+
+
+   def append(self, row):
+      if self.size == len(self._rows):
+         grown = np.empty((2 * len(self._rows), len(self.columns)), dtype=np.float64)
+         grown[:self.size] = self._rows[:self.size]
+         self._rows = grown
+      self._rows[self.size] = row
+      self.size += 1
+
+
+   def column(self, name):
+      """View of column `name` over the rows appended so far."""
+      return self._rows[:self.size, self.columns.index(name)]
+
+
+class HandAnalyzer(HandParams):
+   name = "hand"
+   NO_WRIST = (np.nan, np.nan)
+
+   def __init__(self, hands_model, sample_rate=None, gate=MOTION_GATE):
+      self.hands_model = hands_model
+      self.sample_rate = sample_rate
+      self.gate = MotionGate() if gate else None
+      self.last_wrist = self.NO_WRIST
+      self.inferences = 0
+      self.samples = SampleBuffer(("timestamp", "index", "calibrating", "wrist_x", "wrist_y", "inferred"))
+      self.clock = SampleClock(sample_rate) if sample_rate else None
+      self.done = False
+      self.calibrated = False
+      self.baseline_count = 0
+      self.start_time = None
+      self.calibration_frame_count = 0
+      self.tracking_frame_count = 0
+      self.first_tracking_index = None
+      self.last_index = None
+
+
+   @property
+   def total_frames(self):
+      # Source frames covered by tracking, including any the decoder skipped.
+      if self.first_tracking_index is None:
+         return 0
+      return self.last_index - self.first_tracking_index + 1
+
+
+   def sampled(self, frame, frame_count):
+      if self.clock is not None:
+         return self.clock.take(frame.timestamp)
+      return frame_count % self.FRAME_SKIP_RATE == 0
+
+
+   def analyze_hand_position(self, frame):
+      """Record the wrist position in `frame`; returns True if a hand was found."""
+      inferred = self.gate is None or self.gate.changed(frame)
+      if inferred:
+         res = self.hands_model.process(frame.rgb)
+         self.inferences += 1
+         self.last_wrist = self.NO_WRIST
+         if res.multi_hand_landmarks:
+            wrist = res.multi_hand_landmarks[0].landmark[self.WRIST_LANDMARK]
+            self.last_wrist = (wrist.x, wrist.y)
+      wrist_x, wrist_y = self.last_wrist
+      self.samples.append((frame.timestamp, frame.index, not self.calibrated, wrist_x, wrist_y, inferred))
+      return not math.isnan(wrist_y)
+
+
+   def process(self, frame):
+      if not self.calibrated:
+         # Media time, not wall-clock time, so every machine calibrates on
+         # the same frames and results do not depend on load.
+         if self.start_time is None:
+            self.start_time = frame.timestamp
+         if frame.timestamp - self.start_time < self.CALIBRATION_DURATION:
+            if self.sampled(frame, self.calibration_frame_count):
+               if self.analyze_hand_position(frame):
+                  self.baseline_count += 1
+            self.calibration_frame_count += 1
+            return
+         if not self.baseline_count:
+            self.done = True
+            return
+         self.calibrated = True
+
+      if self.first_tracking_index is None:
+         self.first_tracking_index = frame.index
+      self.last_index = frame.index
+      if self.sampled(frame, self.tracking_frame_count):
+         self.analyze_hand_position(frame)
+      self.tracking_frame_count += 1
+
+
+   def columns(self):
+      """Return the recorded samples as columns, with coordinates at full precision."""
+      wrist_y = self.samples.column("wrist_y")
+      return {
+         "timestamp": self.samples.column("timestamp"),
+         "index": self.samples.column("index").astype(np.int64),
+         "calibrating": self.samples.column("calibrating").astype(bool),
+         "detected": ~np.isnan(wrist_y),
+         "wrist_x": self.samples.column("wrist_x"),
+         "wrist_y": wrist_y,
+         "inferred": self.samples.column("inferred").astype(bool),
+      }
+
+
+   def features(self):
+      """Return the recorded samples as columns, plus the scoring metadata."""
+      columns = self.columns()
+      columns["wrist_x"] = columns["wrist_x"].astype(np.float32)
+      columns["wrist_y"] = columns["wrist_y"].astype(np.float32)
+      meta = {"total_frames": self.total_frames}
+      return columns, meta
+
+
+   @classmethod
+   def score(cls, columns, total_frames, movement_threshold=None, baseline_window=None):
+      """Share of tracked frames whose wrist is off the baseline, over a whole record."""
+      movement_threshold = cls.MOVEMENT_THRESHOLD if movement_threshold is None else movement_threshold
+      baseline_window = cls.BASELINE_WINDOW if baseline_window is None else baseline_window
+      detected = columns["detected"]
+      calibrating = columns["calibrating"]
+      wrist_y = columns["wrist_y"].astype(np.float64)
+
+      calibration = wrist_y[calibrating & detected]
+      if calibration.size == 0:
+         return HandResult()
+      tracked = ~calibrating & detected
+      baseline = calibration.mean()
+      if baseline_window > 0:
+         baseline = cls.rolling_baseline(columns["timestamp"][detected], wrist_y[detected],
+                                         columns["timestamp"][tracked], baseline_window, baseline)
+      good_movement_frames = np.count_nonzero(np.abs(wrist_y[tracked] - baseline) > movement_threshold)
+      score = good_movement_frames / total_frames * 100 if total_frames > 0 else 0.0
+      return HandResult(score=float(score), detected=True)
+
+
+   @staticmethod
+   def rolling_baseline(timestamps, wrist_y, at, window, fallback):
+      """Mean of `wrist_y` over [t - window, t) for each t in `at`, or `fallback` where empty."""
+      sums = np.concatenate(([0.0], np.cumsum(wrist_y)))
+      lo = np.searchsorted(timestamps, at - window, side="left")
+      hi = np.searchsorted(timestamps, at, side="left")
+      counts = hi - lo
+      means = (sums[hi] - sums[lo]) / np.maximum(counts, 1)
+      return np.where(counts > 0, means, fallback)
+
+
+   def result(self):
+      """Return a HandResult; `detected` is False if no baseline was found."""
+      return self.score(self.columns(), self.total_frames)
+
+
+class MoodAnalyzer(MoodParams):
+   name = "mood"
+
+   # FaceMesh landmarks measured for the smile ratio, and their buffer columns.
+   MOUTH_RIGHT, MOUTH_LEFT, LEFT_EYE_INNER, RIGHT_EYE_INNER = 61, 291, 33, 263
+   POINT_COLUMNS = ("mouth_right_x", "mouth_right_y", "mouth_left_x", "mouth_left_y",
+                    "left_eye_x", "left_eye_y", "right_eye_x", "right_eye_y")
+   NO_POINTS = (np.nan,) * len(POINT_COLUMNS)
+
+   def __init__(self, face_mesh_model, sample_rate=None, gate=MOTION_GATE, roi=FACE_ROI):
+      self.face_mesh_model = face_mesh_model
+      self.sample_rate = sample_rate
+      self.gate = MotionGate() if gate else None
+      self.detail_width = ROI_DETAIL_WIDTH if roi else None
+      self.track_face = roi
+      # Normalized (x0, y0, x1, y1) landmark bounds of the tracked face.
+      self.face_box = None
+      # "crop" or "frame": what the face mesh was last run on.
+      self.model_input = None
+      self.last_points = self.NO_POINTS
+      self.inferences = 0
+      self.samples = SampleBuffer(("timestamp", "index") + self.POINT_COLUMNS + ("inferred",))
+      self.schedule = self.new_schedule()
+      self.done = False
+      self.total_frames = 0
+
+
+   def analyze_mood(self, frame):
+      inferred = self.gate is None or self.gate.changed(frame)
+      if inferred:
+         self.last_points = self.measure(frame)
+         self.inferences += 1
+      self.samples.append((frame.timestamp, frame.index) + self.last_points + (inferred,))
+
+
+   def new_schedule(self):
+      """A fresh copy of this analyzer's sampling rule.
+
+      A reader given one (see VideoStream) and shown the same frames knows
+      which of them this analyzer will sample, and so which need a detail copy.
+      """
+      if self.sample_rate:
+         return SampleClock(self.sample_rate)
+      return FrameStride(self.FRAME_SKIP_RATE)
+
+
+   def process_input(self, image, kind):
+      # FaceMesh tracks landmarks from call to call in its input's
+      # coordinates, so switching between crop and whole frame starts afresh.
+      if kind != self.model_input:
+         if self.model_input is not None:
+            self.face_mesh_model.reset()
+         self.model_input = kind
+      return self.face_mesh_model.process(image)
+
+
+   def landmarks_in_face_box(self, frame):
+      """Run the face mesh on a crop around the tracked face.
+
+      Returns the crop's landmarks and the (x0, x_scale, y0, y_scale) that
+      map their coordinates onto the whole frame, or None if the face was
+      lost.
+      """
+      image = frame.detail
+      h, w = image.shape[:2]
+      x0, y0, x1, y1 = self.face_box
+      side = min(int(max((x1 - x0) * w, (y1 - y0) * h) * (1 + 2 * ROI_MARGIN)), w, h)
+      if side < ROI_MIN_SIZE:
+         return None
+      left = int(np.clip((x0 + x1) / 2 * w - side / 2, 0, w - side))
+      top = int(np.clip((y0 + y1) / 2 * h - side / 2, 0, h - side))
+      crop = image[top:top + side, left:left + side]
+      interpolation = cv2.INTER_AREA if side > ROI_INPUT_SIZE else cv2.INTER_LINEAR
+      crop = cv2.resize(crop, (ROI_INPUT_SIZE, ROI_INPUT_SIZE), interpolation=interpolation)
+      res = self.process_input(cv2.cvtColor(crop, cv2.COLOR_BGR2RGB), "crop")
+      if not res.multi_face_landmarks:
+         return None
+      return res.multi_face_landmarks[0].landmark, (left / w, side / w, top / h, side / h)
+
+
+   def measure(self, frame):
+      """Run the face mesh on `frame`; returns the raw coordinates for POINT_COLUMNS."""
+      found = None
+      if self.face_box is not None:
+         found = self.landmarks_in_face_box(frame)
+      if found is None:
+         # No face tracked yet, or it was lost: search the whole frame.
+         res = self.process_input(frame.rgb, "frame")
+         if res.multi_face_landmarks:
+            found = res.multi_face_landmarks[0].landmark, (0.0, 1.0, 0.0, 1.0)
+      if found is None:
+         self.face_box = None
+         return self.NO_POINTS
+      lm, (x0, x_scale, y0, y_scale) = found
+      if self.track_face:
+         # Only the tracked box needs every landmark; scoring needs four.
+         xs = [p.x for p in lm]
+         ys = [p.y for p in lm]
+         self.face_box = (x0 + x_scale * min(xs), y0 + y_scale * min(ys),
+                          x0 + x_scale * max(xs), y0 + y_scale * max(ys))
+      points = ()
+      for index in (self.MOUTH_RIGHT, self.MOUTH_LEFT, self.LEFT_EYE_INNER, self.RIGHT_EYE_INNER):
+         p = lm[index]
+         points += (x0 + x_scale * p.x, y0 + y_scale * p.y)
+      return points
+
+
+   def process(self, frame):
+      self.total_frames += 1
+      if self.schedule.take(frame.timestamp):
+         self.analyze_mood(frame)
+
+
+   def columns(self):
+      """Return mouth width and eye distance for every sample as float64 columns."""
+      c = self.samples.column
+      mouth_dx, mouth_dy = c("mouth_left_x") - c("mouth_right_x"), c("mouth_left_y") - c("mouth_right_y")
+      eye_dx, eye_dy = c("left_eye_x") - c("right_eye_x"), c("left_eye_y") - c("right_eye_y")
+      mouth_width = np.sqrt(mouth_dx * mouth_dx + mouth_dy * mouth_dy)
+      eye_distance = np.sqrt(eye_dx * eye_dx + eye_dy * eye_dy)
+      return {
+         "timestamp": c("timestamp"),
+         "index": c("index").astype(np.int64),
+         "detected": ~np.isnan(mouth_width),
+         "mouth_width": mouth_width,
+         "eye_distance": eye_distance,
+         "inferred": c("inferred").astype(bool),
+      }
+
+
+   def features(self):
+      """Return the recorded samples as columns, plus the scoring metadata."""
+      columns = self.columns()
+      columns["mouth_width"] = columns["mouth_width"].astype(np.float32)
+      columns["eye_distance"] = columns["eye_distance"].astype(np.float32)
+      return columns, {}
+
+
+   @classmethod
+   def label(cls, score, positive=None, negative=None):
+      positive = cls.POSITIVE_THRESHOLD if positive is None else positive
+      negative = cls.NEGATIVE_THRESHOLD if negative is None else negative
+      if score > positive:
+         return "OVERALL: Positive"
+      if score < negative:
+         return "OVERALL: Negative"
+      return "OVERALL: Neutral"
+
+
+   @classmethod
+   def score(cls, columns, positive=None, negative=None):
+      """Mean mouth/eye width ratio over a whole record."""
+      eye_distance = columns["eye_distance"].astype(np.float64)
+      valid = columns["detected"] & (eye_distance > 0)
+      if not valid.any():
+         return MoodResult()
+      score = float(np.mean(columns["mouth_width"][valid] / eye_distance[valid]))
+      return MoodResult(label=cls.label(score, positive, negative), score=score, detected=True)
+
+
+   def result(self):
+      return self.score(self.columns())
+
+
+def open_stream(video_file, decoder=None, process_width=PROCESS_WIDTH, sample_rates=None, detail_width=None,
+                detail_schedule=None, trace=None):
+   """Start a frame reader for `video_file` on the named decoder backend.
+
+   "opencv" is VideoStream; "ffmpeg" is streaming.PipeVideoStream reading
+   the file, decimated to the highest of `sample_rates` when given. Only
+   VideoStream makes detail copies; ffmpeg frames use the image as detail.
+   """
+   decoder = decoder or DEFAULT_DECODER
+   if decoder not in DECODERS:
+      raise ValueError(f"Unknown decoder: {decoder}")
+   if decoder == "ffmpeg":
+      from streaming import PipeVideoStream
+
+      rate = max(sample_rates) if sample_rates else None
+      return PipeVideoStream(rate, process_width, src=video_file, trace=trace).start()
+   return VideoStream(video_file, process_width, sample_rates=sample_rates, detail_width=detail_width,
+                      detail_schedule=detail_schedule, trace=trace).start()
+
+
+def run_pipeline(video_file, analyzers, process_width=PROCESS_WIDTH, stream=None, decoder=None, trace=None):
+   """Decode `video_file` once and feed every frame to all `analyzers`.
+
+   Each analyzer consumes frames on its own thread through a bounded queue,
+   so model inference for one analyzer overlaps with the others while the
+   decode and resize cost is paid a single time. When every analyzer has a
+   `sample_rate`, only frames on one of their sampling grids are decoded.
+   A started `stream` (e.g. a streaming.PipeVideoStream) can be passed in
+   place of opening `video_file` with the `decoder` backend (see
+   open_stream). Decode and per-analyzer timings are added to `trace`.
+   Returns a dict mapping analyzer name to its result object.
+   """
+   trace = trace or Trace()
+   vs = stream
+   if vs is None:
+      sample_rates = [a.sample_rate for a in analyzers]
+      if not all(sample_rates):
+         # A frame-stride analyzer needs to see every frame.
+         sample_rates = None
+      # An analyzer that crops (see MoodAnalyzer) asks for a detail copy of
+      # the frames it samples.
+      croppers = [a for a in analyzers if getattr(a, "detail_width", None)]
+      detail_width = croppers[0].detail_width if croppers else None
+      detail_schedule = croppers[0].new_schedule() if croppers else None
+      vs = open_stream(video_file, decoder, process_width, sample_rates, detail_width, detail_schedule, trace)
+   queues = [Queue(maxsize=ANALYZER_QUEUE_SIZE) for _ in analyzers]
+   errors = []
+
+
+   def consume(analyzer, q):
+      wall = cpu = 0.0
+      frames = depth = 0
+      while True:
+         depth = max(depth, q.qsize())
+         frame = q.get()
+         if frame is None:
+            break
+         if analyzer.done:
+            frame.release()
+            continue
+         started, started_cpu = time.perf_counter(), time.thread_time()
+         try:
+            analyzer.process(frame)
+         except Exception as e:
+            errors.append(e)
+            analyzer.done = True
+         finally:
+            frame.release()
+         wall += time.perf_counter() - started
+         cpu += time.thread_time() - started_cpu
+         frames += 1
+      trace.add(f"{analyzer.name}.process", wall, cpu, calls=frames, frames=frames, queue_depth=depth,
+                inferences=analyzer.inferences)
+
+
+   workers = [threading.Thread(target=consume, args=(a, q), daemon=True) for a, q in zip(analyzers, queues)]
+   for worker in workers:
+      worker.start()
 
    try:
-       vs = VideoStream(VIDEO_FILE).start()
-   except IOError as e:
-       exit()
-
-
-   with mp_face_mesh.FaceMesh(
-           max_num_faces=1,
-           refine_landmarks=False,
-           min_detection_confidence=0.5,
-           min_tracking_confidence=0.3) as face_mesh:
-
-
-       all_mood_scores = []
-       current_mood_score = 0.0
-       total_frames = 0
-       tracking_frame_count = 0
-       start_tracking = time.time()
+      for frame in vs:
+         active = [(a, q) for a, q in zip(analyzers, queues) if not a.done]
+         frame.share(len(active))
+         if not active:
+            break
+         for _, q in active:
+            q.put(frame)
+   finally:
+      for q in queues:
+         q.put(None)
+      for worker in workers:
+         worker.join()
+      vs.stop()
+
+   if errors:
+      raise errors[0]
+   if stream is None and getattr(vs, "failed", False):
+      # The ffmpeg backend only finds out it cannot decode once it runs.
+      raise IOError(f"Could not decode video: {video_file}")
+   return {a.name: a.result() for a in analyzers}
+
+
+def analyze(video_file, modes=("mood", "hand"), sample_rates=None, stream=None, features_path=None, decoder=None,
+            trace=None):
+   """Run the requested analyzers over a single shared decode of the video.
+
+   `sample_rates` maps analyzer name to samples per second of media time;
+   analyzers left out fall back to their FRAME_SKIP_RATE stride. Models are
+   checked out of the process-wide pools in models.py and returned, reset,
+   when the video is done. With `features_path` each analyzer also writes
+   its per-sample record to `<features_path>.<name>.npz` (see features.py).
+   `decoder` picks the frame-source backend, "opencv" or "ffmpeg".
+   Stage timings are recorded into `trace` (a metrics.Trace) when given.
+   """
+   sample_rates = sample_rates or {}
+   record = features_path is not None
+
+   with ExitStack() as stack:
+      analyzers = []
+      if "mood" in modes:
+         face_mesh = stack.enter_context(get_pool("face_mesh").checkout())
+         analyzers.append(MoodAnalyzer(face_mesh, sample_rates.get("mood")))
+      if "hand" in modes:
+         hands = stack.enter_context(get_pool("hands").checkout())
+         analyzers.append(HandAnalyzer(hands, sample_rates.get("hand")))
+      results = run_pipeline(video_file, analyzers, stream=stream, decoder=decoder, trace=trace)
+
+   if record:
+      from features import save_features
+
+      for analyzer in analyzers:
+         try:
+            save_features(f"{features_path}.{analyzer.name}.npz", analyzer)
+         except Exception:
+            # The results stand without their record; a failed write only
+            # costs a re-decode when rescoring.
+            pass
+   return results
 
 
-      
-       while vs.more():
-           frame = vs.read()
-           total_frames += 1
-           if tracking_frame_count % FRAME_SKIP_RATE == 0:
-               score = analyze_mood(frame, face_mesh)
-               if score is not None:
-                   current_mood_score = score
-                   all_mood_scores.append(score)
-           tracking_frame_count += 1
-
+def hand(video_file):
+   """Return the HandResult for `video_file`. Raises IOError if it cannot be opened.
 
-       duration = time.time() - start_tracking
-       if all_mood_scores:
-           overall_avg_score = np.mean(all_mood_scores)
-           if overall_avg_score > 0.75:
-               overall_mood = "OVERALL: Positive"
-           elif overall_avg_score < 0.45:
-               overall_mood = "OVERALL: Negative"
-           else:
-               overall_mood = "OVERALL: Neutral"
-       else:
-           overall_mood = "OVERALL: Unknown"
-           overall_avg_score = 0.0
+   Calibration and sampling follow media timestamps, so a given file scores
+   the same on any machine and under any load.
+   """
+   return analyze(video_file, modes=("hand",))["hand"]
 
 
-   vs.stop()
-   result = {"mood": overall_mood, "score": overall_avg_score}
-   print(json.dumps(result))
-   return result
+def mood(video_path):
+   """Return the MoodResult for `video_path`. Raises IOError if it cannot be opened."""
+   return analyze(video_path, modes=("mood",))["mood"]
 
 
 
 
 if __name__ == "__main__":
    if len(sys.argv) < 3:
-       print(f"[ERROR] Insufficient args: {sys.argv}")
-       print("Usage: python analyze.py [mood|hand] path/to/video.mp4")
-       sys.exit(1)
+      print(f"[ERROR] Insufficient args: {sys.argv}")
+      print("Usage: python analyze.py [mood|hand] path/to/video.mp4")
+      sys.exit(1)
 
 
    mode = sys.argv[1]
@@ -277,8 +864,16 @@ if __name__ == "__main__":
 
 
    if mode == "hand":
-       hand(video_path)
+      analyzer = hand
    elif mode == "mood":
-       mood(video_path)
+      analyzer = mood
    else:
-       exit(1)
+      sys.exit(1)
+
+   try:
+      result = analyzer(video_path)
+   except IOError as e:
+      sys.exit()
+   if mode == "hand" and not result.detected:
+      sys.exit()
+   print(json.dumps(result.to_dict()))